@@ -0,0 +1,481 @@
+"""離線效能測試：以固定種子的模擬日K資料量測分析流程各階段，並與 benchmark_baseline.json 比較
+
+主程式 (import yfinance as yf.py) 的 benchmark 子命令會載入本模組；也可以直接執行
+python benchmarks.py [--update-baseline]。基準為產生它的機器上的量測值，換機器時請先更新基準。
+"""
+import gc
+import importlib.util
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, 'import yfinance as yf.py')
+BASELINE_FILE = os.path.join(HERE, 'benchmark_baseline.json')
+
+def _script_module():
+    """取得主程式模組：已載入 (例如以 __main__ 執行) 時直接使用，否則依檔案路徑載入"""
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path and os.path.abspath(path) == SCRIPT:
+            return module
+    spec = importlib.util.spec_from_file_location('stock_analysis', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+stock = _script_module()
+StockAnalyzer = stock.StockAnalyzer
+GeneticAlgorithm = stock.GeneticAlgorithm
+GAStateStore = stock.GAStateStore
+PriceSeries = stock.PriceSeries
+optimize_cross_section = stock.optimize_cross_section
+build_fitness_tables = stock.build_fitness_tables
+fitness_from_tables = stock.fitness_from_tables
+
+def _synthetic_history(years: int, seed: int = 0, volatility: float = 0.02) -> pd.DataFrame:
+    """產生模擬的日K資料 (均值回歸的對數價格)，供離線效能測試使用"""
+    rng = np.random.default_rng(seed)
+    n = years * 252
+    shocks = rng.normal(0, volatility, n)
+    log_price = np.zeros(n)
+    for i in range(1, n):
+        log_price[i] = 0.97 * log_price[i - 1] + shocks[i]
+    close = 100 * np.exp(log_price)
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    index = pd.bdate_range(end='2024-12-31', periods=n)
+    return pd.DataFrame({
+        'Open': close,
+        'High': close + spread,
+        'Low': close - spread,
+        'Close': close,
+        'Volume': rng.integers(1_000, 1_000_000, n)
+    }, index=index)
+
+def benchmark_profit_engine(years_list=(5, 20), repeats: int = 5) -> Dict[int, Dict[str, float]]:
+    """比較向量化與原始迴圈版 analyze_profit_patterns 的執行時間"""
+    results = {}
+    for years in years_list:
+        analyzer = StockAnalyzer(symbol='BENCH')
+        analyzer.historical_data = _synthetic_history(years)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            expected = analyzer._analyze_profit_patterns_loop()
+        loop_time = (time.perf_counter() - start) / repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            actual = analyzer.analyze_profit_patterns()
+        vector_time = (time.perf_counter() - start) / repeats
+
+        if actual != expected:
+            raise AssertionError(f"{years}y 向量化結果與原始實作不一致")
+
+        results[years] = {
+            'loop_seconds': loop_time,
+            'vectorized_seconds': vector_time,
+            'speedup': loop_time / vector_time
+        }
+        print(f"{years}y: 迴圈 {loop_time*1000:.2f}ms, 向量化 {vector_time*1000:.2f}ms, "
+              f"加速 {loop_time / vector_time:.1f}x")
+    return results
+
+def benchmark_genetic_operators(population_sizes=(50, 500, 2000),
+                                chromosome_length: int = 10,
+                                generations: int = 3) -> Dict[int, Dict[str, float]]:
+    """比較字串版與陣列版遺傳運算子 (初始化、選擇、交配、突變) 每世代的執行時間"""
+    results = {}
+    for size in population_sizes:
+        ga = GeneticAlgorithm(population_size=size, chromosome_length=chromosome_length)
+        rng = np.random.default_rng(0)
+
+        start = time.perf_counter()
+        population = ga.initialize_population()
+        for _ in range(generations):
+            fitness_values = rng.random(size).tolist()
+            new_population = []
+            for _ in range(size // 2):
+                parent1, parent2 = ga.select_parents(population, fitness_values)
+                child1, child2 = ga.crossover(parent1, parent2)
+                new_population.extend([ga.mutate(child1), ga.mutate(child2)])
+            population = new_population
+        string_time = (time.perf_counter() - start) / generations
+
+        start = time.perf_counter()
+        population = ga.initialize_population_array()
+        for _ in range(generations):
+            fitness_values = rng.random(size)
+            parents = ga.select_parents_array(fitness_values, size // 2)
+            children1, children2 = ga.crossover_array(population[parents[:, 0]], population[parents[:, 1]])
+            population = ga.mutate_array(np.concatenate([children1, children2]))
+        array_time = (time.perf_counter() - start) / generations
+
+        results[size] = {
+            'string_seconds': string_time,
+            'array_seconds': array_time,
+            'speedup': string_time / array_time
+        }
+        print(f"族群 {size}: 字串 {string_time*1000:.2f}ms/世代, 陣列 {array_time*1000:.2f}ms/世代, "
+              f"加速 {string_time / array_time:.1f}x")
+    return results
+
+def benchmark_cross_section(num_symbols: int = 200, handful: int = 5, years: int = 5) -> Dict[str, float]:
+    """比較逐檔遺傳算法優化 handful 檔與 optimize_cross_section 一次優化 num_symbols 檔的時間
+
+    並以逐檔窮舉確認前 handful 檔的最佳參數一致
+    """
+    histories = {f"S{i:04d}": _synthetic_history(years, seed=i) for i in range(num_symbols)}
+
+    start = time.perf_counter()
+    for symbol in list(histories)[:handful]:
+        analyzer = StockAnalyzer(symbol=symbol)
+        analyzer.historical_data = histories[symbol]
+        analyzer.optimize_parameters()
+    per_symbol_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = optimize_cross_section(histories)
+    cross_section_time = time.perf_counter() - start
+
+    for symbol in list(histories)[:handful]:
+        analyzer = StockAnalyzer(symbol=symbol)
+        analyzer.historical_data = histories[symbol]
+        analyzer.optimize_parameters(exhaustive=True)
+        if analyzer.parameters() != (results[symbol]['params'] or analyzer.parameters()):
+            raise AssertionError(f"{symbol} 的橫斷面優化結果與逐檔窮舉不一致")
+
+    print(f"逐檔遺傳算法 {handful} 檔: {per_symbol_time:.3f}s, "
+          f"橫斷面優化 {num_symbols} 檔: {cross_section_time:.3f}s")
+    return {'per_symbol_seconds': per_symbol_time, 'cross_section_seconds': cross_section_time}
+
+# 工作行程啟動時由共享記憶體的價格建立一次適應度表格
+_worker_tables = None
+
+def _init_fitness_worker(descriptor: dict):
+    global _worker_tables
+    prices = PriceSeries.attach(descriptor)
+    try:
+        _worker_tables = build_fitness_tables(*prices.arrays())
+    finally:
+        prices.release()
+
+def _worker_fitness_batch(params_list: List[dict]) -> List[float]:
+    return [fitness_from_tables(_worker_tables, params) for params in params_list]
+
+def benchmark_parallel_fitness(worker_counts=(1, 2, 4, 8), years: int = 20, generations: int = 50,
+                               repeats: int = 3, seed: int = 42) -> Dict[int, Dict[str, float]]:
+    """比較不同工作行程數下以 ProcessPoolExecutor 計算適應度的時間，確認適應度計算是否值得平行化
+
+    工作量為一次遺傳算法實際送出的各世代批次 (記憶化後每代只剩少數未計算的參數) 與整個參數空間的窮舉；
+    1 個工作行程時直接在本行程計算，其他則把每批平均切給工作行程，結果須與單行程一致。
+    工作行程以 PriceSeries 共享記憶體建立表格，行程池啟動時間另外列出
+    """
+    analyzer = StockAnalyzer(symbol='BENCH')
+    analyzer.historical_data = _synthetic_history(years)
+    analyzer.ga = GeneticAlgorithm(generations=generations, seed=seed)
+    batches = []
+
+    def record(params_list):
+        batches.append(params_list)
+        return analyzer.fitness_batch(params_list)
+    analyzer.ga.evolve(analyzer.fitness_function, batch_fitness_func=record)
+    workloads = {
+        'evolve': batches,
+        'exhaustive': [[analyzer.ga.decode_chromosome(chromosome)
+                        for chromosome in analyzer.ga.parameter_space()]]
+    }
+    tables = analyzer.fitness_tables()
+    expected = {name: [[fitness_from_tables(tables, params) for params in batch] for batch in workload]
+                for name, workload in workloads.items()}
+
+    results = {}
+    prices = analyzer.prices
+    descriptor = prices.publish()
+    try:
+        for n_workers in worker_counts:
+            start = time.perf_counter()
+            executor = (ProcessPoolExecutor(max_workers=n_workers, initializer=_init_fitness_worker,
+                                            initargs=(descriptor,)) if n_workers > 1 else None)
+            if executor is not None:
+                list(executor.map(abs, range(n_workers)))  # 等所有工作行程啟動並建立表格
+            startup = time.perf_counter() - start
+
+            def evaluate(batch):
+                if executor is None:
+                    return [fitness_from_tables(tables, params) for params in batch]
+                chunk_size = -(-len(batch) // n_workers)
+                chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+                return [score for scores in executor.map(_worker_fitness_batch, chunks) for score in scores]
+
+            try:
+                results[n_workers] = {'startup_seconds': startup}
+                for name, workload in workloads.items():
+                    times = []
+                    for _ in range(repeats):
+                        start = time.perf_counter()
+                        scores = [evaluate(batch) for batch in workload]
+                        times.append(time.perf_counter() - start)
+                    if scores != expected[name]:
+                        raise AssertionError(f"{n_workers} 個工作行程的 {name} 適應度與單行程不一致")
+                    results[n_workers][f"{name}_seconds"] = min(times)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            print(f"{n_workers} workers: 啟動 {startup:.3f}s, 遺傳算法 {len(batches)} 批 "
+                  f"{sum(map(len, batches))} 組 {results[n_workers]['evolve_seconds']:.3f}s, "
+                  f"窮舉 {len(workloads['exhaustive'][0])} 組 {results[n_workers]['exhaustive_seconds']:.3f}s")
+    finally:
+        prices.release(unlink=True)
+    return results
+
+def _yfinance_frame(years: int, seed: int = 0) -> pd.DataFrame:
+    """模擬 yfinance history() 的完整欄位與含時區的索引，作為記憶體比較的基準"""
+    data = _synthetic_history(years, seed=seed).astype(float)
+    data['Dividends'] = 0.0
+    data['Stock Splits'] = 0.0
+    data.index = data.index.tz_localize('Asia/Taipei')
+    return data
+
+def benchmark_price_series(years_list=(5, 20), repeats: int = 20) -> Dict[int, Dict[str, float]]:
+    """比較完整 DataFrame 與 PriceSeries (float64 / float32) 每檔股票的記憶體，
+    以及傳給工作行程時 pickle DataFrame 與傳遞共享記憶體 descriptor 的大小與時間"""
+    results = {}
+    for years in years_list:
+        frame = _yfinance_frame(years)
+        series64 = PriceSeries.from_frame(frame)
+        series32 = PriceSeries.from_frame(frame, dtype=np.float32)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            payload = pickle.dumps(frame)
+            pickle.loads(payload)
+        frame_pickle_time = (time.perf_counter() - start) / repeats
+
+        descriptor = series64.publish()
+        try:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                attached = PriceSeries.attach(pickle.loads(pickle.dumps(descriptor)))
+                attached.release()
+            attach_time = (time.perf_counter() - start) / repeats
+            descriptor_bytes = len(pickle.dumps(descriptor))
+        finally:
+            series64.release(unlink=True)
+
+        results[years] = {
+            'frame_bytes': int(frame.memory_usage(deep=True).sum()),
+            'float64_bytes': series64.nbytes,
+            'float32_bytes': series32.nbytes,
+            'frame_pickle_bytes': len(payload),
+            'descriptor_pickle_bytes': descriptor_bytes,
+            'frame_pickle_seconds': frame_pickle_time,
+            'attach_seconds': attach_time
+        }
+        print(f"{years}y: DataFrame {results[years]['frame_bytes'] / 1024:.0f}KB, "
+              f"PriceSeries float64 {series64.nbytes / 1024:.0f}KB / float32 {series32.nbytes / 1024:.0f}KB; "
+              f"pickle {len(payload) / 1024:.0f}KB ({frame_pickle_time * 1e6:.0f}µs) → "
+              f"descriptor {descriptor_bytes}B (attach {attach_time * 1e6:.0f}µs)")
+    return results
+
+def benchmark_warm_start(days: int = 10, years: int = 5, seeds=range(10)) -> Dict[str, float]:
+    """模擬每日新增一根K棒後重新優化，比較冷啟動與暖啟動平均使用的世代數、適應度計算次數與最佳適應度
+
+    狀態存在每次新建的暫存目錄，第 0 天一定是冷啟動，結果不受前次執行影響
+    """
+    history = _synthetic_history(years)
+    totals = {'cold_generations': 0, 'warm_generations': 0, 'cold_evaluations': 0,
+              'warm_evaluations': 0, 'cold_fitness': 0.0, 'warm_fitness': 0.0}
+    runs = 0
+    with tempfile.TemporaryDirectory(prefix='benchmark_ga_state_') as state_root:
+        for seed in seeds:
+            store = GAStateStore(os.path.join(state_root, str(seed)))
+            for day in range(days + 1):
+                data = history.iloc[:len(history) - days + day]
+                for mode in ('cold', 'warm'):
+                    analyzer = StockAnalyzer(symbol='BENCH')
+                    analyzer.historical_data = data
+                    analyzer.ga.seed = seed * 1000 + day
+                    analyzer.optimize_parameters(state_store=store if mode == 'warm' else None)
+                    if day > 0:  # 第 0 天用來建立暖啟動狀態
+                        totals[f"{mode}_generations"] += analyzer.ga.run_summary['generations']
+                        totals[f"{mode}_evaluations"] += analyzer.ga.run_summary['evaluations']
+                        totals[f"{mode}_fitness"] += analyzer.ga.best_fitness
+                runs += day > 0
+
+    results = {key: value / runs for key, value in totals.items()}
+    print(f"冷啟動 平均 {results['cold_generations']:.1f} 代 / {results['cold_evaluations']:.1f} 次計算 "
+          f"(適應度 {results['cold_fitness']:.4f})，暖啟動 平均 {results['warm_generations']:.1f} 代 / "
+          f"{results['warm_evaluations']:.1f} 次計算 (適應度 {results['warm_fitness']:.4f})")
+    return results
+
+VOLATILITY_REGIMES = {'low': 0.01, 'normal': 0.02, 'high': 0.04}
+
+def _benchmark_stage(func, repeats: int) -> Dict[str, float]:
+    """執行 func repeats 次取最短時間 (與 timeit 相同，計時期間停用垃圾回收)，
+    再以 tracemalloc 另外執行一次量測峰值記憶體"""
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': int(peak)}
+
+def benchmark_suite(years_list=(1, 5, 20), regimes: Optional[Dict[str, float]] = None,
+                    repeats: int = 5, generations: int = 20, seed: int = 0) -> dict:
+    """以固定種子的模擬日K資料量測各階段的執行時間、峰值記憶體與適應度計算次數
+
+    鍵為 "<年數>y/<波動區間>/<階段>"，階段涵蓋 calculate_price_intervals、analyze_profit_patterns、
+    fitness_function、evolve、generate_trading_rules 與 plot_analysis
+    """
+    regimes = VOLATILITY_REGIMES if regimes is None else regimes
+    stages = {}
+    for years in years_list:
+        for regime, volatility in regimes.items():
+            data = _synthetic_history(years, seed=seed, volatility=volatility)
+            analyzer = StockAnalyzer(symbol='BENCH')
+            analyzer.historical_data = data
+            prefix = f"{years}y/{regime}"
+
+            stages[f"{prefix}/calculate_price_intervals"] = _benchmark_stage(
+                analyzer.calculate_price_intervals, repeats)
+            stages[f"{prefix}/analyze_profit_patterns"] = _benchmark_stage(
+                analyzer.analyze_profit_patterns, repeats)
+
+            params = analyzer.parameters()
+            analyzer.fitness_function(params)  # 先建立適應度查表，量測單次評估成本
+            result = _benchmark_stage(lambda: analyzer.fitness_function(params), repeats)
+            result['fitness_evals'] = 1
+            stages[f"{prefix}/fitness_function"] = result
+
+            def run_evolve():
+                analyzer._fitness_tables = None
+                analyzer.ga = GeneticAlgorithm(generations=generations, seed=seed)
+                analyzer.ga.evolve(analyzer.fitness_function, batch_fitness_func=analyzer.fitness_batch)
+            result = _benchmark_stage(run_evolve, repeats)
+            result['fitness_evals'] = analyzer.ga.cache_misses
+            result['cache_hits'] = analyzer.ga.cache_hits
+            result['best_fitness'] = analyzer.ga.best_fitness
+            stages[f"{prefix}/evolve"] = result
+
+            analyzer.analyze_profit_patterns()
+            stages[f"{prefix}/generate_trading_rules"] = _benchmark_stage(
+                analyzer.generate_trading_rules, repeats)
+
+            def run_plot():
+                fig = analyzer.plot_analysis()
+                fig.canvas.draw()
+                fig.clear()
+            stages[f"{prefix}/plot_analysis"] = _benchmark_stage(run_plot, repeats)
+
+            print(f"{prefix}: " + ", ".join(
+                f"{name.split('/')[-1]} {stages[name]['seconds']*1000:.2f}ms"
+                for name in stages if name.startswith(prefix + '/')))
+
+    return {
+        'meta': {
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'repeats': repeats,
+            'generations': generations,
+            'seed': seed
+        },
+        'stages': stages
+    }
+
+def compare_benchmarks(current: dict, baseline: dict, time_tolerance: float = 0.25,
+                       memory_tolerance: float = 0.25, min_seconds: float = 0.001) -> List[str]:
+    """與基準比較，回傳退步項目的說明
+
+    時間與峰值記憶體超過基準的 (1 + tolerance) 倍視為退步 (時間差小於 min_seconds 時忽略)；
+    模擬資料與種子固定，適應度計算次數增加一律視為退步
+    """
+    regressions = []
+    for name, base in baseline.get('stages', {}).items():
+        result = current['stages'].get(name)
+        if result is None:
+            continue
+        if (result['seconds'] > base['seconds'] * (1 + time_tolerance)
+                and result['seconds'] - base['seconds'] > min_seconds):
+            regressions.append(f"{name}: 時間 {base['seconds']*1000:.2f}ms → {result['seconds']*1000:.2f}ms")
+        if result['peak_bytes'] > base['peak_bytes'] * (1 + memory_tolerance):
+            regressions.append(f"{name}: 峰值記憶體 {base['peak_bytes'] / 1024:.0f}KB → "
+                               f"{result['peak_bytes'] / 1024:.0f}KB")
+        if result.get('fitness_evals', 0) > base.get('fitness_evals', 0):
+            regressions.append(f"{name}: 適應度計算 {base.get('fitness_evals', 0)} → "
+                               f"{result['fitness_evals']} 次")
+    return regressions
+
+def _merge_best(current: dict, rerun: dict):
+    """把重跑的結果併入 current：每個階段保留較短的時間與較小的峰值記憶體"""
+    for name, result in rerun['stages'].items():
+        best = current['stages'].setdefault(name, result)
+        best['seconds'] = min(best['seconds'], result['seconds'])
+        best['peak_bytes'] = min(best['peak_bytes'], result['peak_bytes'])
+
+def run_benchmarks(baseline_file: str = BASELINE_FILE, update_baseline: bool = False,
+                   confirm_runs: int = 2, time_tolerance: float = 0.5, **kwargs) -> dict:
+    """執行 benchmark_suite 並與 baseline_file 比較；基準不存在或 update_baseline=True 時寫入新基準
+
+    有退步時最多再跑 confirm_runs 次整套測試並取各階段的最佳值重新比較，
+    排除單次量測的雜訊；回傳結果的 'regressions' 為確認後仍退步的項目。
+    共用機器上同一階段的時間前後可差 30%，因此時間容許值預設為 50%；適應度計算次數不受影響
+    """
+    current = benchmark_suite(**kwargs)
+    baseline = None
+    if os.path.exists(baseline_file):
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = (compare_benchmarks(current, baseline, time_tolerance=time_tolerance)
+                   if baseline is not None else [])
+    for _ in range(confirm_runs if not update_baseline else 0):
+        if not regressions:
+            break
+        print(f"{len(regressions)} 個項目可能退步，重新量測確認")
+        _merge_best(current, benchmark_suite(**kwargs))
+        regressions = compare_benchmarks(current, baseline, time_tolerance=time_tolerance)
+
+    for line in regressions:
+        logging.warning(f"效能退步 {line}")
+    if baseline is None or update_baseline:
+        with open(baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"已寫入效能基準 {baseline_file}")
+    elif not regressions:
+        print("與效能基準相比沒有退步")
+
+    current['regressions'] = regressions
+    return current
+
+if __name__ == '__main__':
+    sys.exit(stock.cli(['benchmark'] + sys.argv[1:]))
@@ -1,107 +1,782 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from typing import List, Tuple, Dict, Optional
 import logging
-import gradio as gr
-import requests
-from io import StringIO
-import matplotlib.pyplot as plt
+from io import StringIO, BytesIO
+from collections import OrderedDict
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import argparse
 import random
-import matplotlib
+import time
+import threading
+import sys
+import subprocess
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import queue
+from multiprocessing import shared_memory
+import os
+import json
+import tempfile
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，只做行程內的鎖
+    fcntl = None
 
-# 在程式碼開頭加入以下設定
-matplotlib.rcParams['font.family'] = ['Microsoft YaHei']  # 使用微軟正黑體
-# 或是 
-matplotlib.rcParams['font.family'] = ['DFKai-SB']  # 使用標楷體
-matplotlib.rcParams['axes.unicode_minus'] = False   # 讓負號正確顯示
+# yfinance、requests、gradio 與 matplotlib 載入耗時，只在實際用到時才匯入，
+# 讓命令列與排程只做分析時能快速啟動 (見 IMPORT_TIME_BUDGET)
+_matplotlib_classes = None
 
-# 備用方案:如果上述字型都無法使用,可以嘗試:
-plt.rcParams['font.sans-serif'] = ['Microsoft YaHei', 'DFKai-SB', 'SimSun', 'Noto Sans CJK TC']
+def _matplotlib():
+    """第一次繪圖時才載入 matplotlib 並設定中文字型，回傳 (Figure, FigureCanvasAgg)"""
+    global _matplotlib_classes
+    if _matplotlib_classes is None:
+        import matplotlib
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-# 設置中文字型
-plt.rcParams['font.sans-serif'] = ['Noto Sans CJK JP', 'sans-serif']
-plt.rcParams['axes.unicode_minus'] = False
+        # 在程式碼開頭加入以下設定
+        matplotlib.rcParams['font.family'] = ['Microsoft YaHei']  # 使用微軟正黑體
+        # 或是 
+        matplotlib.rcParams['font.family'] = ['DFKai-SB']  # 使用標楷體
+        matplotlib.rcParams['axes.unicode_minus'] = False   # 讓負號正確顯示
 
-def get_stock_list(max_retries=3, retry_delay=1) -> List[Tuple[str, str]]:
-    """取得台股上市股票清單，加入重試機制"""
-    default_stocks = [("2330", "台積電"), ("2317", "鴻海"), ("2308", "台達電")]
-    
-    for attempt in range(max_retries):
+        # 備用方案:如果上述字型都無法使用,可以嘗試:
+        matplotlib.rcParams['font.sans-serif'] = ['Microsoft YaHei', 'DFKai-SB', 'SimSun', 'Noto Sans CJK TC']
+
+        # 設置中文字型
+        matplotlib.rcParams['font.sans-serif'] = ['Noto Sans CJK JP', 'sans-serif']
+        matplotlib.rcParams['axes.unicode_minus'] = False
+
+        _matplotlib_classes = (Figure, FigureCanvasAgg)
+    return _matplotlib_classes
+
+_NULL_CONTEXT = nullcontext()
+
+class SamplingProfiler:
+    """以背景執行緒定期取樣目標執行緒的呼叫堆疊，統計各函式被取樣到的次數"""
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = 0
+        self.cumulative: Dict[str, int] = {}  # 函式出現在堆疊中的次數
+        self.leaf: Dict[str, int] = {}  # 函式位於堆疊頂端的次數
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _label(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}:{code.co_name}"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            leaf = self._label(frame)
+            self.leaf[leaf] = self.leaf.get(leaf, 0) + 1
+            seen = set()
+            while frame is not None:
+                label = self._label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.cumulative[label] = self.cumulative.get(label, 0) + 1
+                frame = frame.f_back
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='sampling-profiler')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def top(self, limit: int = 15) -> List[dict]:
+        """依累計取樣次數排序的熱點函式"""
+        ranked = sorted(self.cumulative.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{
+            'function': label,
+            'cumulative': count / self.samples,
+            'self': self.leaf.get(label, 0) / self.samples
+        } for label, count in ranked]
+
+class Metrics:
+    """分析流程的輕量指標：各階段耗時與計數器，以 JSON 日誌及 Prometheus 文字格式輸出
+
+    停用時 stage() 回傳共用的空 context manager、increment() 直接返回，幾乎沒有額外成本。
+    request() 包住單次請求，結束時輸出該請求各階段耗時的 JSON 日誌；
+    profile_next_request() 會讓下一個請求在取樣分析器下執行。
+    """
+
+    PREFIX = 'stock_analyzer'
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.logger = logging.getLogger(f"{__name__}.metrics")
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._stages: Dict[str, List[float]] = {}  # 階段 -> [次數, 總秒數, 最長秒數]
+        self._local = threading.local()
+        self._profile_interval = None
+        self._server = None
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._stages.clear()
+
+    def increment(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current['counters'][name] = current['counters'].get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            stat = self._stages.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current['stages'][name] = current['stages'].get(name, 0.0) + seconds
+
+    def stage(self, name: str):
+        """計時的 context manager：with metrics.stage('fetch_data'): ..."""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
         try:
-            url = "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2"
-            response = requests.get(url, timeout=10)
-            response.encoding = 'big5'
-            
-            if response.status_code != 200:
-                raise requests.RequestException(f"HTTP error {response.status_code}")
-                
-            df = pd.read_html(StringIO(response.text))[0]
-            df = df.iloc[2:, [0, 1]]
-            df.columns = ['代碼和名稱', '公司名稱']
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
 
-            df['股票代碼'] = df['代碼和名稱'].str.split().str[0]
-            df['股票名稱'] = df['代碼和名稱'].str.split().str[1]
-            
-            # 更嚴格的股票代碼驗證
-            mask = df['股票代碼'].str.match(r'^\d{4}$') & df['股票名稱'].notna()
-            df = df[mask]
-            
-            if df.empty:
-                raise ValueError("No valid stock data found")
-                
-            return list(zip(df['股票代碼'].tolist(), df['股票名稱'].tolist()))
-            
-        except Exception as e:
-            logging.warning(f"第 {attempt + 1} 次嘗試取得股票列表失敗: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                logging.error(f"無法取得股票列表，使用預設值: {e}")
-                return default_stocks
+    def profile_next_request(self, interval: float = 0.005):
+        """讓下一個 request() 在 SamplingProfiler 下執行，並將熱點函式附在請求日誌中"""
+        self._profile_interval = interval
 
-def scrape_stock_data():
-    """抓取股票資料並加入錯誤處理與快取機制"""
-    cache_file = 'stock_data_cache.pkl'
-    
-    # 檢查快取
-    try:
-        if os.path.exists(cache_file):
-            if time.time() - os.path.getmtime(cache_file) < 86400:  # 24小時內的快取
-                return pd.read_pickle(cache_file)
-    except:
-        pass
-        
-    url = "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2"
-    
-    headers = {
+    @contextmanager
+    def request(self, name: str, **fields):
+        """單次請求的範圍；結束時輸出一行 JSON 日誌 (各階段耗時、計數器與取樣結果)
+
+        產生的 dict 為這次請求的結果，預設 {'status': 'ok'}；呼叫端自行處理的錯誤或取消
+        可改寫 status 並加入其他欄位 (例如 error)，未處理的例外一律記為 'error'
+        """
+        outcome = {'status': 'ok'}
+        if not self.enabled:
+            yield outcome
+            return
+
+        with self._lock:
+            interval, self._profile_interval = self._profile_interval, None
+        profiler = SamplingProfiler(interval=interval) if interval is not None else None
+        current = {'stages': {}, 'counters': {}}
+        self._local.request = current
+        if profiler is not None:
+            profiler.start()
+        start = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException as e:
+            outcome.update(status='error', error=str(e))
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.stop()
+            self._local.request = None
+            self.observe(name, seconds)
+            self.increment(f"{name}_{outcome['status']}")  # 例如 analyze_stock_cancelled_total
+            record = {'event': name, **outcome, 'seconds': seconds, **fields,
+                      'stages': current['stages'], 'counters': current['counters']}
+            if profiler is not None:
+                record['profile'] = profiler.top()
+            self.logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'stages': {name: {'count': count, 'seconds': total, 'max_seconds': longest}
+                           for name, (count, total, longest) in self._stages.items()}
+            }
+
+    def prometheus_text(self) -> str:
+        """Prometheus 文字格式 (計數器為 *_total，階段耗時為 summary 的 _count / _sum 與 _max)"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"{self.PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        metric = f"{self.PREFIX}_stage_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for name, stat in sorted(snapshot['stages'].items()):
+            lines.append(f'{metric}_count{{stage="{name}"}} {stat["count"]}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {stat["seconds"]}')
+        lines.append(f"# TYPE {metric}_max gauge")
+        for name, stat in sorted(snapshot['stages'].items()):
+            lines.append(f'{metric}_max{{stage="{name}"}} {stat["max_seconds"]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9108, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """於背景執行緒提供 http://host:port/metrics (Prometheus 文字格式)"""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True,
+                         name='metrics-server').start()
+        logging.info(f"指標端點 http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+# 設定環境變數 STOCK_METRICS=1 啟用指標收集
+metrics = Metrics(enabled=os.environ.get('STOCK_METRICS') == '1')
+
+class StockUniverse:
+    """台股上市股票索引 (代號 → 名稱 → 產業別)，附 TTL 磁碟快取與背景更新
+
+    快取過期時以 If-None-Match / If-Modified-Since 條件式請求更新，
+    證交所回應 304 時只更新快取時間，不重新解析 HTML。
+    """
+
+    URL = "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2"
+    HEADERS = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         'Accept': 'text/html,application/xhtml+xml',
         'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7'
     }
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        response.encoding = 'big5'
-        
-        df = pd.read_html(response.text)[0]
-        df.columns = ['有價證券代號及名稱', 'ISIN Code', '上市日', '市場別', '產業別', '公司名稱', '備註']
-        df[['代號', '名稱']] = df['有價證券代號及名稱'].str.split('　', n=1, expand=True)
-        df = df[['代號', '名稱', '產業別']].dropna()
-        
-        # 儲存快取
-        df.to_pickle(cache_file)
-        
-        return df
-        
-    except Exception as e:
-        logging.error(f"抓取股票資料失敗: {str(e)}")
-        # 如果有快取則使用快取
-        if os.path.exists(cache_file):
-            return pd.read_pickle(cache_file)
-        return pd.DataFrame()
+
+    def __init__(self, cache_file: str = 'stock_universe_cache.pkl', ttl: float = 86400):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._cache = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def _read_cache(self) -> Optional[dict]:
+        if self._cache is None and os.path.exists(self.cache_file):
+            try:
+                self._cache = pd.read_pickle(self.cache_file)
+            except Exception as e:
+                logging.warning(f"讀取股票清單快取失敗: {e}")
+        return self._cache
+
+    def is_fresh(self) -> bool:
+        cache = self._read_cache()
+        return cache is not None and time.time() - cache['fetched_at'] < self.ttl
+
+    @staticmethod
+    def parse(html: str) -> pd.DataFrame:
+        """解析證交所 ISIN 頁面，回傳代號、名稱、產業別"""
+        df = pd.read_html(StringIO(html))[0]
+        parts = df.iloc[:, 0].astype(str).str.split(n=1)
+        universe = pd.DataFrame({
+            '代號': parts.str[0],
+            '名稱': parts.str[1],
+            '產業別': df.iloc[:, 4]
+        })
+        return universe[universe['代號'].notna() & universe['名稱'].notna()].reset_index(drop=True)
+
+    def refresh(self, max_retries: int = 3, retry_delay: float = 1) -> pd.DataFrame:
+        """向證交所更新股票清單 (條件式請求)，失敗時保留舊快取"""
+        with self._lock:
+            cache = self._read_cache()
+            headers = dict(self.HEADERS)
+            if cache is not None:
+                if cache.get('etag'):
+                    headers['If-None-Match'] = cache['etag']
+                if cache.get('last_modified'):
+                    headers['If-Modified-Since'] = cache['last_modified']
+
+            for attempt in range(max_retries):
+                try:
+                    import requests
+                    response = requests.get(self.URL, headers=headers, timeout=10)
+                    if response.status_code == 304 and cache is not None:
+                        cache['fetched_at'] = time.time()
+                    else:
+                        response.raise_for_status()
+                        response.encoding = 'big5'
+                        data = self.parse(response.text)
+                        if data.empty:
+                            raise ValueError("No valid stock data found")
+                        cache = {
+                            'data': data,
+                            'fetched_at': time.time(),
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified')
+                        }
+
+                    # 先寫入暫存檔再取代，避免其他行程讀到寫到一半的快取
+                    pd.to_pickle(cache, self.cache_file + '.tmp')
+                    os.replace(self.cache_file + '.tmp', self.cache_file)
+                    self._cache = cache
+                    return cache['data']
+
+                except Exception as e:
+                    logging.warning(f"第 {attempt + 1} 次嘗試取得股票列表失敗: {e}")
+                    if attempt < max_retries - 1:
+                        time.sleep(retry_delay)
+
+            logging.error("無法更新股票列表")
+            return cache['data'] if cache is not None else pd.DataFrame(columns=['代號', '名稱', '產業別'])
+
+    def refresh_in_background(self) -> threading.Thread:
+        """在背景執行緒更新清單 (同時只會有一個更新中)"""
+        if self._refresh_thread is None or not self._refresh_thread.is_alive():
+            self._refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            self._refresh_thread.start()
+        return self._refresh_thread
+
+    def get(self, block: bool = True) -> pd.DataFrame:
+        """取得股票清單；block=False 時立即回傳快取 (可能為空)，過期部分改由背景更新"""
+        if self.is_fresh():
+            return self._cache['data']
+        if block:
+            return self.refresh()
+
+        self.refresh_in_background()
+        cache = self._read_cache()
+        return cache['data'] if cache is not None else pd.DataFrame(columns=['代號', '名稱', '產業別'])
+
+# 共用的股票清單索引
+stock_universe = StockUniverse()
+
+DEFAULT_STOCKS = [("2330", "台積電"), ("2317", "鴻海"), ("2308", "台達電")]
+
+def get_stock_list(max_retries=3, retry_delay=1, block: bool = True) -> List[Tuple[str, str]]:
+    """取得台股上市股票清單 (4 碼普通股)，優先使用快取；block=False 時不等待網路"""
+    if block and not stock_universe.is_fresh():
+        df = stock_universe.refresh(max_retries, retry_delay)
+    else:
+        df = stock_universe.get(block=block)
+
+    # 更嚴格的股票代碼驗證
+    df = df[df['代號'].str.match(r'^\d{4}$')]
+    if df.empty:
+        logging.warning("無可用的股票列表，使用預設值")
+        return DEFAULT_STOCKS
+    return list(zip(df['代號'].tolist(), df['名稱'].tolist()))
+
+def scrape_stock_data():
+    """抓取股票資料 (代號、名稱、產業別)，使用 24 小時快取"""
+    return stock_universe.get()[['代號', '名稱', '產業別']].dropna()
+
+def yfinance_source(symbol: str, start: Optional[pd.Timestamp] = None,
+                    period: Optional[str] = None) -> pd.DataFrame:
+    """從 Yahoo Finance 取得台股日K資料；指定 start 時只取該日之後的資料"""
+    import yfinance as yf
+
+    ticker = yf.Ticker(f"{symbol}.TW")
+    if start is not None:
+        return ticker.history(start=start.strftime('%Y-%m-%d'))
+    return ticker.history(period=period)
+
+class BarStore:
+    """本地端以欄位分檔儲存的每檔股票日K資料
+
+    每個欄位是一個只會往後附加的原始 float64 檔 (日期為 datetime64[ns] 的 int64)，
+    讀取時以 memory map 只載入需要的日期區段與欄位。日期檔最後寫入，
+    因此寫到一半中斷時，多出來的欄位資料會以日期筆數為準被忽略。
+    同一檔股票的寫入與更新以每檔一把的鎖串行 (同一資料夾的所有 BarStore 實例共用)。
+    """
+
+    COLUMNS = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+    _locks: Dict[str, threading.RLock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, root: str = 'bar_store', source=yfinance_source,
+                 refresh_interval: float = 3600):
+        self.root = root
+        self.source = source
+        self.refresh_interval = refresh_interval  # 距上次更新未超過此秒數時不再向資料來源查詢
+
+    def _path(self, symbol: str, name: str) -> str:
+        return os.path.join(self.root, symbol, name)
+
+    def _lock(self, symbol: str) -> threading.RLock:
+        key = os.path.abspath(os.path.join(self.root, symbol))
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.RLock())
+
+    def _load(self, symbol: str, name: str, dtype=np.float64) -> Optional[np.ndarray]:
+        path = self._path(symbol, name)
+        if not os.path.exists(path):
+            return None
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def _load_dates(self, symbol: str) -> Optional[np.ndarray]:
+        dates = self._load(symbol, 'dates', dtype=np.int64)
+        return None if dates is None else dates.view('datetime64[ns]')
+
+    def _count(self, symbol: str) -> int:
+        path = self._path(symbol, 'dates')
+        return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+    def read_meta(self, symbol: str) -> dict:
+        try:
+            with open(self._path(symbol, 'meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, symbol: str, meta: dict):
+        with open(self._path(symbol, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    def last_date(self, symbol: str) -> Optional[pd.Timestamp]:
+        count = self._count(symbol)
+        if count == 0:
+            return None
+        with open(self._path(symbol, 'dates'), 'rb') as f:
+            f.seek((count - 1) * 8)
+            return pd.Timestamp(np.frombuffer(f.read(8), dtype='datetime64[ns]')[0])
+
+    def read(self, symbol: str,
+             start: Optional[pd.Timestamp] = None,
+             end: Optional[pd.Timestamp] = None,
+             columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """讀取指定日期區間 (含頭尾) 與欄位的資料"""
+        columns = list(columns or self.COLUMNS)
+        dates = self._load_dates(symbol)
+        if dates is None:
+            return pd.DataFrame(columns=columns)
+
+        lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), side='right')
+
+        data = {}
+        for column in columns:
+            values = self._load(symbol, column)
+            data[column] = np.array(values[lo:hi]) if values is not None else np.full(hi - lo, np.nan)
+        return pd.DataFrame(data, index=pd.DatetimeIndex(np.array(dates[lo:hi]), name='Date'))
+
+    def _normalize(self, data: pd.DataFrame) -> pd.DataFrame:
+        """只保留儲存的欄位並將日期轉為台北時間的無時區日期"""
+        index = pd.DatetimeIndex(data.index)
+        if index.tz is not None:
+            index = index.tz_convert('Asia/Taipei').tz_localize(None)
+        return pd.DataFrame({column: data[column].to_numpy(dtype=float)
+                             for column in self.COLUMNS if column in data},
+                            index=index.normalize())
+
+    def write(self, symbol: str, data: pd.DataFrame, replace: bool = False) -> int:
+        """將新資料合併進本地資料 (同日期以新資料為準)，整個重寫，回傳新增的交易日數
+
+        replace=True 時捨棄既有資料，只保留 data (用於還原價格整段改變後的重新下載)。
+        """
+        if data is None or data.empty:
+            return 0
+
+        incoming = self._normalize(data)
+        with self._lock(symbol):
+            existing = self.read(symbol)
+            combined = pd.concat([existing.iloc[:0] if replace else existing, incoming])
+            combined = combined[~combined.index.duplicated(keep='last')].sort_index()
+
+            directory = os.path.join(self.root, symbol)
+            os.makedirs(directory, exist_ok=True)
+            # 先寫入各自唯一的暫存檔再取代，避免讀取端或其他行程看到寫到一半的檔案
+            for column in self.COLUMNS + ('dates',):
+                if column == 'dates':
+                    values = combined.index.to_numpy(dtype='datetime64[ns]').view(np.int64)
+                elif column in combined:
+                    values = combined[column].to_numpy(dtype=np.float64)
+                else:
+                    values = np.full(len(combined), np.nan)
+                fd, tmp_path = tempfile.mkstemp(prefix=f'{column}.', suffix='.tmp', dir=directory)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(values.tobytes())
+                    os.replace(tmp_path, self._path(symbol, column))
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            return int((~combined.index.isin(existing.index)).sum())
+
+    def append_arrays(self, symbol: str, dates: np.ndarray, columns: Dict[str, np.ndarray]) -> int:
+        """直接把比最後儲存日更新的資料附加到各欄位檔尾端，回傳新增的交易日數
+
+        dates 須為遞增的 datetime64[ns]；columns 缺少的欄位以 NaN 補齊。
+        """
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        with self._lock(symbol):
+            count = self._count(symbol)
+            if count:
+                keep = dates > np.datetime64(self.last_date(symbol))
+                dates = dates[keep]
+                columns = {column: np.asarray(values)[keep] for column, values in columns.items()}
+            if len(dates) == 0:
+                return 0
+
+            os.makedirs(os.path.join(self.root, symbol), exist_ok=True)
+            for column in self.COLUMNS:
+                values = columns.get(column)
+                values = np.full(len(dates), np.nan) if values is None else np.asarray(values, dtype=np.float64)
+                with open(self._path(symbol, column), 'ab') as f:
+                    f.truncate(count * 8)  # 去除上次中斷時多寫的資料
+                    f.write(values.tobytes())
+            with open(self._path(symbol, 'dates'), 'ab') as f:
+                f.write(dates.view(np.int64).tobytes())
+            return len(dates)
+
+    def append(self, symbol: str, data: pd.DataFrame) -> int:
+        """只附加比最後儲存日更新的資料 (不重新合併既有資料)，回傳新增的交易日數"""
+        if data is None or data.empty:
+            return 0
+
+        incoming = self._normalize(data).sort_index()
+        return self.append_arrays(symbol, incoming.index.to_numpy(dtype='datetime64[ns]'),
+                                  {column: incoming[column].to_numpy() for column in incoming})
+
+    def _has_corporate_action(self, data: pd.DataFrame, after: pd.Timestamp) -> bool:
+        """after 之後的資料是否有除權息或股票分割 (yfinance history() 的 Dividends / Stock Splits 欄位)"""
+        if data is None or data.empty:
+            return False
+        newer = np.asarray(self._normalize(data).index > after)
+        return any(column in data and bool((data[column].to_numpy(dtype=float)[newer] != 0).any())
+                   for column in ('Dividends', 'Stock Splits'))
+
+    def refresh(self, symbol: str, years: int) -> int:
+        """向資料來源補抓最後儲存日 (含) 之後的資料，回傳新增的交易日數
+
+        最後一根K棒可能是盤中抓到的未完成資料，因此每次都重新抓取並以新資料覆蓋。
+        """
+        if self.source is None:
+            return 0  # 純本地資料庫 (例如只由每日 TWSE 快照更新)
+
+        # 同一檔同時只有一個更新者，後到的請求會看到剛寫入的 refreshed_at 而不再重抓
+        with self._lock(symbol):
+            meta = self.read_meta(symbol)
+            last = self.last_date(symbol)
+            years = max(years, meta.get('years', 0))
+            replace = False
+
+            if last is None or meta.get('years', 0) < years:
+                data = self.source(symbol, period=f"{years}y")
+            elif time.time() - meta.get('refreshed_at', 0) < self.refresh_interval:
+                return 0
+            else:
+                data = self.source(symbol, start=last)
+                if self._has_corporate_action(data, after=last):
+                    # 除權息或分割會改變 history() 整段的還原價格，只附加新K棒會與完整下載不一致
+                    logging.info(f"{symbol} 有新的除權息或分割，重新下載 {years} 年資料")
+                    data = self.source(symbol, period=f"{years}y")
+                    replace = True
+
+            appended = self.write(symbol, data, replace=replace)
+            if self.last_date(symbol) is not None:
+                self._write_meta(symbol, {'years': years, 'refreshed_at': time.time()})
+            return appended
+
+    def refresh_many(self, symbols: List[str], years: int, max_workers: int = 8) -> Dict[str, Optional[Exception]]:
+        """以有限的並行數批次更新多檔股票，回傳每檔的錯誤 (成功為 None)"""
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.refresh, symbol, years): symbol for symbol in symbols}
+            for future in as_completed(futures):
+                errors[futures[future]] = future.exception()
+        return errors
+
+# TWSE STOCK_DAY_ALL 欄位與本地資料欄位的對應
+TWSE_SNAPSHOT_COLUMNS = {
+    'OpeningPrice': 'Open',
+    'HighestPrice': 'High',
+    'LowestPrice': 'Low',
+    'ClosingPrice': 'Close',
+    'TradeVolume': 'Volume'
+}
+
+def load_twse_snapshot(snapshot) -> pd.DataFrame:
+    """解析 TWSE STOCK_DAY_ALL 全市場日快照 (檔案路徑或已載入的 list)，回傳以股票代碼為索引的 OHLCV
+
+    字串一次向量化轉為數值，'--' 或空字串等缺值轉為 NaN，沒有收盤價 (當日未成交) 的股票會被略過。
+    """
+    if isinstance(snapshot, str):
+        with open(snapshot, encoding='utf-8') as f:
+            snapshot = json.load(f)
+
+    raw = pd.DataFrame(snapshot)
+    data = pd.DataFrame(index=pd.Index(raw['Code'].astype(str).str.strip(), name='Code'))
+    for source_column, column in TWSE_SNAPSHOT_COLUMNS.items():
+        values = raw[source_column].astype(str).str.replace(',', '', regex=False).to_numpy()
+        data[column] = pd.to_numeric(values, errors='coerce')
+
+    return data[data['Close'].notna()]
+
+TWSE_BAR_STORE_ROOT = 'twse_bar_store'  # TWSE 原始 (未還原權息) 價格，與 yfinance 還原價格分開存放
+
+def ingest_twse_snapshot(snapshot,
+                         trade_date,
+                         bar_store: Optional[BarStore] = None) -> int:
+    """將一天的 TWSE 全市場快照附加到每檔股票的本地資料，回傳有新增資料的股票數
+
+    快照本身不含日期，因此必須指定 trade_date；資料只會往後附加，日期給錯之後無法修正。
+    預設寫入 TWSE_BAR_STORE_ROOT，不與 yfinance_source 的還原價格混在同一個序列。
+    """
+    if bar_store is None:
+        bar_store = BarStore(TWSE_BAR_STORE_ROOT, source=None)
+    trade_date = pd.Timestamp(trade_date).normalize()
+
+    data = load_twse_snapshot(snapshot)
+    data = data[~data.index.duplicated(keep='last')]
+
+    dates = np.array([trade_date.to_datetime64()], dtype='datetime64[ns]')
+    values = data.to_numpy(dtype=np.float64)
+    appended = 0
+    for code, row in zip(data.index, values):
+        columns = {column: row[i:i + 1] for i, column in enumerate(data.columns)}
+        appended += bar_store.append_arrays(code, dates, columns) > 0
+    return appended
+
+class PriceSeries:
+    """分析用的精簡價格序列：交易日 (int64 ns) 與收盤、最高、最低價的連續陣列，並快取最高/最低價
+
+    publish() 將資料放進 multiprocessing.shared_memory，回傳的 descriptor 只有幾十個位元組，
+    工作行程以 PriceSeries.attach(descriptor) 直接對應同一塊記憶體，不需複製或 pickle 價格資料。
+    """
+
+    def __init__(self, dates: np.ndarray, close: np.ndarray, high: np.ndarray, low: np.ndarray,
+                 high_max: Optional[float] = None, low_min: Optional[float] = None):
+        self.dates = dates
+        self.close = close
+        self.high = high
+        self.low = low
+        self.high_max = float(np.nanmax(high)) if high_max is None else high_max
+        self.low_min = float(np.nanmin(low)) if low_min is None else low_min
+        self._shm = None
+        self._attached = False  # 陣列是否為共享記憶體的視圖
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, dtype=np.float64) -> 'PriceSeries':
+        """由日K資料建立；dtype=np.float32 時價格減半，極值仍以 float64 計算後快取
+
+        陣列一律複製，不會是 DataFrame 內部區塊的視圖，原本的 DataFrame 可以整個釋放
+        """
+        high = data['High'].to_numpy(dtype=np.float64)
+        low = data['Low'].to_numpy(dtype=np.float64)
+        index = pd.DatetimeIndex(data.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)  # 保留當地日期 (與 BarStore 儲存的日期一致)
+        return cls(dates=np.array(index.as_unit('ns').asi8, copy=True),
+                   close=np.array(data['Close'].to_numpy(dtype=dtype), copy=True),
+                   high=np.array(high, dtype=dtype, copy=True),
+                   low=np.array(low, dtype=dtype, copy=True),
+                   high_max=float(np.nanmax(high)),
+                   low_min=float(np.nanmin(low)))
+
+    def __len__(self) -> int:
+        return len(self.close)
+
+    @property
+    def nbytes(self) -> int:
+        return self.dates.nbytes + self.close.nbytes + self.high.nbytes + self.low.nbytes
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(收盤, 最高, 最低) 的 float64 陣列 (已是 float64 時不複製)"""
+        return tuple(values.astype(np.float64, copy=False) for values in (self.close, self.high, self.low))
+
+    @property
+    def index(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.dates.view('datetime64[ns]'), name='Date')
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({'Close': self.close, 'High': self.high, 'Low': self.low}, index=self.index)
+
+    def publish(self) -> dict:
+        """複製到新的共享記憶體區塊，回傳給 attach 使用的 descriptor；用完後以 release(unlink=True) 釋放"""
+        n = len(self)
+        itemsize = self.close.dtype.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(1, n * (8 + 3 * itemsize)))
+        shm_series = self._views(shm, n, self.close.dtype)
+        for name in ('dates', 'close', 'high', 'low'):
+            getattr(shm_series, name)[:] = getattr(self, name)
+        del shm_series
+        self._shm = shm
+        return {
+            'name': shm.name,
+            'length': n,
+            'dtype': self.close.dtype.str,
+            'high_max': self.high_max,
+            'low_min': self.low_min
+        }
+
+    @staticmethod
+    def _views(shm, n: int, dtype) -> 'PriceSeries':
+        dtype = np.dtype(dtype)
+        offset = n * 8
+        columns = [np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=offset + i * n * dtype.itemsize)
+                   for i in range(3)]
+        return PriceSeries(np.ndarray(n, dtype=np.int64, buffer=shm.buf), *columns,
+                           high_max=0.0, low_min=0.0)
+
+    @classmethod
+    def attach(cls, descriptor: dict) -> 'PriceSeries':
+        """對應 publish() 建立的共享記憶體 (零複製)，用完後呼叫 release()"""
+        try:
+            shm = shared_memory.SharedMemory(name=descriptor['name'], track=False)  # Python 3.13+
+        except TypeError:
+            # 較舊版本會向資源追蹤器重複登記；工作行程與建立者共用同一個追蹤器，由建立者 unlink
+            shm = shared_memory.SharedMemory(name=descriptor['name'])
+        series = cls._views(shm, descriptor['length'], descriptor['dtype'])
+        series.high_max = descriptor['high_max']
+        series.low_min = descriptor['low_min']
+        series._shm = shm
+        series._attached = True
+        return series
+
+    def release(self, unlink: bool = False):
+        """關閉共享記憶體 (unlink=True 時一併刪除)；之後不可再使用這個序列的陣列"""
+        if self._shm is None:
+            return
+        shm, self._shm = self._shm, None
+        if self._attached:
+            # 仍有視圖指向共享記憶體時無法關閉
+            self.dates = self.close = self.high = self.low = None
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+# 遺傳算法可搜尋的參數範圍
+INTERVAL_RANGE = (3, 6)
+HOLDING_PERIOD_RANGE = (5, 25)
 
 @dataclass
 class TradingInterval:
@@ -112,33 +787,376 @@ class TradingInterval:
     sample_size: int
     is_buy_signal: bool
 
+def compute_trading_intervals(close_prices: np.ndarray,
+                              intervals: List[Tuple[float, float]],
+                              holding_period: int,
+                              target_profit_ratio: float,
+                              confidence_threshold: float) -> List[TradingInterval]:
+    """以 NumPy 向量化計算各價格區間的獲利統計"""
+    close = np.asarray(close_prices, dtype=float)
+    max_idx = len(close) - holding_period
+    if max_idx <= 0 or len(intervals) == 0:
+        return []
+
+    buy_prices = close[:max_idx]
+    profits = close[holding_period:holding_period + max_idx] - buy_prices
+
+    return summarize_interval_bins(assign_price_bins(buy_prices, intervals), profits,
+                                   intervals, target_profit_ratio, confidence_threshold)
+
+def assign_price_bins(prices: np.ndarray, intervals: List[Tuple[float, float]]) -> np.ndarray:
+    """以 searchsorted 一次找出每個價格所屬區間 (lower <= price < upper)，不屬於任何區間者為 -1"""
+    prices = np.asarray(prices, dtype=float)
+    lowers = np.array([interval[0] for interval in intervals], dtype=float)
+    uppers = np.array([interval[1] for interval in intervals], dtype=float)
+
+    bins = np.searchsorted(lowers, prices, side='right') - 1
+    valid = bins >= 0
+    valid[valid] = prices[valid] < uppers[bins[valid]]
+    bins[~valid] = -1
+    return bins
+
+def summarize_interval_bins(bins: np.ndarray,
+                            profits: np.ndarray,
+                            intervals: List[Tuple[float, float]],
+                            target_profit_ratio: float,
+                            confidence_threshold: float) -> List[TradingInterval]:
+    """由每筆買進的區間編號與獲利彙總出各區間的統計"""
+    lowers = np.array([interval[0] for interval in intervals], dtype=float)
+    uppers = np.array([interval[1] for interval in intervals], dtype=float)
+
+    valid = bins >= 0
+    bins = bins[valid]
+    profits = profits[valid]
+
+    counts = np.bincount(bins, minlength=len(intervals))
+    targets = target_profit_ratio * (uppers - lowers)
+    hits = np.bincount(bins, weights=profits >= targets[bins], minlength=len(intervals))
+
+    # 穩定排序後每個區間的獲利為連續切片，平均值與逐筆累加的結果完全一致
+    order = np.argsort(bins, kind='stable')
+    sorted_profits = profits[order]
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    trading_intervals = []
+    for i, interval in enumerate(intervals):
+        if counts[i] == 0:
+            continue
+        profit_probability = hits[i] / counts[i]
+        trading_intervals.append(TradingInterval(
+            lower_bound=interval[0],
+            upper_bound=interval[1],
+            avg_profit=np.mean(sorted_profits[offsets[i]:offsets[i + 1]]),
+            profit_probability=profit_probability,
+            sample_size=int(counts[i]),
+            is_buy_signal=profit_probability >= confidence_threshold
+        ))
+
+    return trading_intervals
+
+WALK_FORWARD_DTYPE = np.dtype([
+    ('index', np.int32),              # 決策日 (historical_data 中的位置)
+    ('interval', np.int8),            # 當日收盤價所在區間，-1 表示不在任何區間
+    ('signal', np.bool_),             # 依訓練視窗統計是否為買進訊號
+    ('train_count', np.int32),        # 訓練視窗中該區間的樣本數
+    ('train_avg_profit', np.float32),
+    ('train_probability', np.float32),
+    ('oos_profit', np.float32),       # 決策日買進、持有 holding_period 天的實際獲利
+    ('oos_hit', np.bool_)             # 實際獲利是否達到目標
+])
+
+def walk_forward_backtest(close_prices: np.ndarray,
+                          num_intervals: int,
+                          holding_period: int,
+                          target_profit_ratio: float,
+                          confidence_threshold: float,
+                          train_window: int = 250,
+                          high_prices: Optional[np.ndarray] = None,
+                          low_prices: Optional[np.ndarray] = None,
+                          intervals: Optional[List[Tuple[float, float]]] = None) -> np.ndarray:
+    """逐日滑動訓練視窗的樣本外回測
+
+    決策日 t 的訓練樣本為買進日落在 [t - holding_period - train_window + 1, t - holding_period]
+    的交易 (t 日時結果皆已知)。區間邊界預設由同一段 (到 t 日為止) 的最高/最低價等分為
+    num_intervals 個區間，不使用 t 日之後的資料；high_prices / low_prices 未指定時以收盤價代替。
+
+    指定 intervals 時改用固定的區間邊界，各區間的樣本數、獲利總和與達標次數以累計值維護，
+    視窗前進一天只需加入一筆、移除一筆；邊界若取自整段歷史 (如 calculate_price_intervals)
+    會含有未來資料，只適合用來比較。
+    """
+    close = np.asarray(close_prices, dtype=float)
+    n = len(close)
+    first_step = train_window + holding_period - 1
+    last_step = n - 1 - holding_period
+    num_bins = num_intervals if intervals is None else len(intervals)
+    if num_bins == 0 or last_step < first_step:
+        return np.empty(0, dtype=WALK_FORWARD_DTYPE)
+
+    steps = np.arange(first_step, last_step + 1)
+    enter = steps - holding_period + 1      # 視窗右端 (不含)
+    leave = enter - train_window            # 視窗左端
+    profits = close[holding_period:] - close[:n - holding_period]
+    oos_profit = close[steps + holding_period] - close[steps]
+
+    if intervals is None:
+        # 每個決策日各自的區間邊界：edges[:, i] 與 price_intervals 的第 i 個下界相同，最後一欄為上界
+        span = train_window + holding_period
+        high = close if high_prices is None else np.asarray(high_prices, dtype=float)
+        low = close if low_prices is None else np.asarray(low_prices, dtype=float)
+        window_high = np.lib.stride_tricks.sliding_window_view(high, span).max(axis=1)[leave]
+        window_low = np.lib.stride_tricks.sliding_window_view(low, span).min(axis=1)[leave]
+        interval_length = (window_high - window_low) / num_bins
+        edges = window_low[:, None] + np.arange(num_bins + 1) * interval_length[:, None]
+        bin_targets = target_profit_ratio * (edges[:, 1:] - edges[:, :-1])
+
+        def to_bins(prices: np.ndarray) -> np.ndarray:
+            # 與 assign_price_bins 相同：lower <= price < upper，不屬於任何區間者為 -1
+            row_edges = edges if prices.ndim == 1 else edges[:, None, :]
+            above = (prices[..., None] >= row_edges).sum(axis=-1)
+            return np.where((above >= 1) & (above <= num_bins), above - 1, -1)
+
+        train_buys = np.lib.stride_tricks.sliding_window_view(close[:n - holding_period], train_window)[leave]
+        train_profits = np.lib.stride_tricks.sliding_window_view(profits, train_window)[leave]
+        train_bins = to_bins(train_buys)
+        step_bins = to_bins(close[steps])
+        in_interval = step_bins >= 0
+        column = np.where(in_interval, step_bins, 0)
+        step_targets = bin_targets[np.arange(len(steps)), column]
+
+        matched = (train_bins == step_bins[:, None]) & in_interval[:, None]
+        counts = matched.sum(axis=1)
+        profit_sums = np.where(matched, train_profits, 0).sum(axis=1)
+        hit_counts = (matched & (train_profits >= step_targets[:, None])).sum(axis=1)
+    else:
+        lowers = np.array([interval[0] for interval in intervals], dtype=float)
+        uppers = np.array([interval[1] for interval in intervals], dtype=float)
+        targets = target_profit_ratio * (uppers - lowers)
+
+        bins = assign_price_bins(close, intervals)
+        buy_bins = bins[:n - holding_period]
+        hits = (buy_bins >= 0) & (profits >= targets[buy_bins])
+
+        # 各區間的累計樣本數、獲利總和與達標次數 (第 j 列為買進日 < j 的合計)
+        onehot = buy_bins[:, None] == np.arange(num_bins)
+        zero_row = np.zeros((1, num_bins))
+        cum_count = np.concatenate([zero_row, np.cumsum(onehot, axis=0)])
+        cum_profit = np.concatenate([zero_row, np.cumsum(onehot * profits[:, None], axis=0)])
+        cum_hits = np.concatenate([zero_row, np.cumsum(onehot & hits[:, None], axis=0)])
+
+        step_bins = bins[steps]
+        in_interval = step_bins >= 0
+        column = np.where(in_interval, step_bins, 0)
+        step_targets = targets[column]
+
+        counts = cum_count[enter, column] - cum_count[leave, column]
+        profit_sums = cum_profit[enter, column] - cum_profit[leave, column]
+        hit_counts = cum_hits[enter, column] - cum_hits[leave, column]
+        counts = np.where(in_interval, counts, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_profit = np.where(counts > 0, profit_sums / counts, np.nan)
+        probability = np.where(counts > 0, hit_counts / counts, np.nan)
+
+    result = np.empty(len(steps), dtype=WALK_FORWARD_DTYPE)
+    result['index'] = steps
+    result['interval'] = step_bins
+    result['signal'] = (counts > 0) & (probability >= confidence_threshold)
+    result['train_count'] = counts
+    result['train_avg_profit'] = avg_profit
+    result['train_probability'] = probability
+    result['oos_profit'] = oos_profit
+    result['oos_hit'] = in_interval & (oos_profit >= step_targets)
+    return result
+
+def price_intervals(high_max: float, low_min: float, num_intervals: int) -> List[Tuple[float, float]]:
+    """將最低價到最高價等分為 num_intervals 個區間"""
+    price_range = high_max - low_min
+    interval_length = price_range / num_intervals
+
+    return [(low_min + i * interval_length,
+            low_min + (i + 1) * interval_length)
+            for i in range(num_intervals)]
+
+def score_trading_intervals(trading_intervals: List[TradingInterval]) -> float:
+    """依買進區間的獲利、機率與樣本數計算綜合得分"""
+    buy_signals = [interval for interval in trading_intervals
+                  if interval.is_buy_signal]
+
+    if not buy_signals:
+        return float('-inf')
+
+    # 計算綜合得分
+    total_profit = sum(interval.avg_profit for interval in buy_signals)
+    avg_probability = np.mean([interval.profit_probability for interval in buy_signals])
+    avg_sample_size = np.mean([interval.sample_size for interval in buy_signals])
+
+    # 加入風險調整因子
+    risk_factor = 1.0 - np.std([interval.avg_profit for interval in buy_signals]) / (total_profit + 1e-6)
+
+    score = (total_profit * avg_probability * np.log1p(avg_sample_size) * max(0.1, risk_factor))
+
+    return float('-inf') if np.isnan(score) or np.isinf(score) else score
+
+def clamp_params(params: dict) -> Optional[Tuple[int, int, float, float]]:
+    """檢查並限制參數範圍，回傳 (區間數, 持有期間, 目標利潤比例, 信心水準)；參數無效時回傳 None"""
+    # 參數合理性檢查
+    if not all(isinstance(v, (int, float)) for v in params.values()):
+        return None
+
+    return (max(INTERVAL_RANGE[0], min(INTERVAL_RANGE[1], params['intervals'])),
+            max(HOLDING_PERIOD_RANGE[0], min(HOLDING_PERIOD_RANGE[1], params['holding_period'])),
+            max(0.5, min(1.3, params['target_profit_ratio'])),
+            max(0.3, min(0.7, params['confidence_threshold'])))
+
+def build_fitness_tables(close: np.ndarray, high: np.ndarray, low: np.ndarray) -> dict:
+    """預先計算所有允許持有期間的遠期獲利與所有區間數的區間編號"""
+    close = np.asarray(close, dtype=float)
+    intervals = {n: price_intervals(np.nanmax(high), np.nanmin(low), n)
+                 for n in range(INTERVAL_RANGE[0], INTERVAL_RANGE[1] + 1)}
+    return {
+        'forward_profits': {hp: close[hp:] - close[:len(close) - hp]
+                            for hp in range(HOLDING_PERIOD_RANGE[0], HOLDING_PERIOD_RANGE[1] + 1)},
+        'intervals': intervals,
+        'bins': {n: assign_price_bins(close, bounds) for n, bounds in intervals.items()}
+    }
+
+def fitness_from_tables(tables: dict, params: dict) -> float:
+    """以預先計算的表格求單組參數的適應度"""
+    try:
+        clamped = clamp_params(params)
+        if clamped is None:
+            return float('-inf')
+        num_intervals, holding_period, target_profit_ratio, confidence_threshold = clamped
+
+        profits = tables['forward_profits'][holding_period]
+        return score_trading_intervals(summarize_interval_bins(
+            tables['bins'][num_intervals][:len(profits)],
+            profits,
+            tables['intervals'][num_intervals],
+            target_profit_ratio,
+            confidence_threshold
+        ))
+
+    except Exception as e:
+        logging.error(f"Fitness calculation error: {e}")
+        return float('-inf')
+
+class EvolutionCancelled(Exception):
+    """遺傳算法演化被 cancel_event 取消"""
+
 class GeneticAlgorithm:
+    # 染色體依序編碼的參數：(名稱, 最小值, 2 位元時的間距, 是否為整數)
+    # 每個參數使用 bits_per_gene 個位元，位元數越多網格越細，整體範圍維持不變
+    PARAM_GENES = (
+        ('intervals', 3, 1, True),                   # 區間數 3-6
+        ('holding_period', 5, 5, True),              # 持有期間 5-20
+        ('target_profit_ratio', 0.5, 0.2, False),    # 目標利潤比例 0.5-1.1
+        ('confidence_threshold', 0.3, 0.1, False)    # 信心水準 0.3-0.6
+    )
+
     def __init__(self,
                  population_size: int = 50,
                  chromosome_length: int = 10,
                  generations: int = 100,
                  crossover_rate: float = 0.8,
-                 mutation_rate: float = 0.1):
+                 mutation_rate: float = 0.1,
+                 exhaustive: bool = False,
+                 max_exhaustive_size: int = 4096,
+                 seed: Optional[int] = None,
+                 bits_per_gene: int = 2,
+                 elitism: int = 0,
+                 stagnation_generations: Optional[int] = None,
+                 min_diversity: float = 0.0,
+                 max_seconds: Optional[float] = None,
+                 max_evaluations: Optional[int] = None):
+        """seed: 固定時每次 evolve 都從相同的亂數狀態開始 (亂數產生器為實例專用，不動到全域亂數)
+        elitism: 每代原封不動保留到下一代的最佳染色體數
+        stagnation_generations: 連續這麼多代最佳適應度沒有進步即停止
+        min_diversity: 族群多樣性 (population_diversity) 低於此值即停止
+        max_seconds / max_evaluations: 每次 evolve 的時間與實際適應度計算次數上限 (於每代結束時檢查)
+        """
+        if chromosome_length < bits_per_gene * len(self.PARAM_GENES):
+            raise ValueError(f"染色體長度 {chromosome_length} 不足以編碼 "
+                             f"{len(self.PARAM_GENES)} 個 {bits_per_gene} 位元的參數")
+        if not 0 <= elitism < population_size:
+            raise ValueError(f"菁英保留數 {elitism} 必須介於 0 與族群數 {population_size} 之間")
+
         self.population_size = population_size
         self.chromosome_length = chromosome_length
         self.generations = generations
         self.crossover_rate = crossover_rate
         self.mutation_rate = mutation_rate
+        self.exhaustive = exhaustive
+        self.max_exhaustive_size = max_exhaustive_size
+        self.seed = seed
+        self.bits_per_gene = bits_per_gene
+        self.elitism = elitism
+        self.stagnation_generations = stagnation_generations
+        self.min_diversity = min_diversity
+        self.max_seconds = max_seconds
+        self.max_evaluations = max_evaluations
+        self.reset_rng()
         self.best_solution = None
         self.best_fitness = float('-inf')
+        self.run_summary: Dict[str, object] = {}
+        self.population: Optional[np.ndarray] = None  # 最後一代的族群
+        self.fitness_history: List[float] = []  # 每一代結束時的最佳適應度
+
+        # warm_start() 設定的前次狀態
+        self._warm_state: Optional[dict] = None
+        self._fresh_fraction = 0.2
+        self._confirm_generations = 3
+
+        # 每次 evolve 重新建立的適應度快取 (以解碼後的參數為鍵)
+        self.fitness_cache: Dict[tuple, float] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def reset_rng(self):
+        """依 seed 重建這個實例專用的亂數產生器，不影響全域 random / np.random 的狀態"""
+        self.rng = np.random.default_rng(self.seed)
+        self.random = random.Random(self.seed)  # 字串版運算子使用
 
     def initialize_population(self) -> List[str]:
-        return [''.join(random.choice('01') for _ in range(self.chromosome_length))
+        return [''.join(self.random.choice('01') for _ in range(self.chromosome_length))
                 for _ in range(self.population_size)]
 
+    def initialize_population_array(self) -> np.ndarray:
+        """以 (族群數, 染色體長度) 的 uint8 陣列表示整個族群"""
+        return self.rng.integers(0, 2, size=(self.population_size, self.chromosome_length),
+                                dtype=np.uint8)
+
+    @staticmethod
+    def to_array(chromosomes: List[str]) -> np.ndarray:
+        return (np.array([list(chrom) for chrom in chromosomes], dtype='U1') == '1').astype(np.uint8)
+
+    @staticmethod
+    def to_string(chromosome: np.ndarray) -> str:
+        return ''.join('1' if bit else '0' for bit in chromosome)
+
+    def population_genes(self, population: np.ndarray) -> np.ndarray:
+        """將族群的位元轉為每個參數的整數值，形狀為 (族群數, 參數數)"""
+        b = self.bits_per_gene
+        bits = population[:, :b * len(self.PARAM_GENES)].reshape(len(population), len(self.PARAM_GENES), b)
+        return bits.astype(np.int64) @ (1 << np.arange(b - 1, -1, -1))
+
+    def decode_genes(self, genes: np.ndarray) -> Dict[str, np.ndarray]:
+        """一次解碼多組參數整數值"""
+        levels = 2 ** self.bits_per_gene
+        decoded = {}
+        for i, (name, low, step, is_int) in enumerate(self.PARAM_GENES):
+            # 2 位元時 3 / (levels - 1) 恰為 1.0，解碼值與原本的間距完全相同
+            values = low + genes[:, i] * (step * (3 / (levels - 1)))
+            decoded[name] = np.rint(values).astype(np.int64) if is_int else values
+        return decoded
+
+    def decode_population(self, population: np.ndarray) -> List[dict]:
+        decoded = self.decode_genes(self.population_genes(population))
+        return [{name: decoded[name][i].item() for name in decoded}
+                for i in range(len(population))]
+
     def decode_chromosome(self, chromosome: str) -> dict:
-        chunks = [chromosome[i:i+2] for i in range(0, len(chromosome), 2)]
-        return {
-            'intervals': 3 + int(chunks[0], 2),  # 區間數 3-6
-            'holding_period': 5 + int(chunks[1], 2) * 5,  # 持有期間 5-25
-            'target_profit_ratio': 0.5 + int(chunks[2], 2) * 0.2,  # 目標利潤比例 0.5-1.3
-            'confidence_threshold': 0.3 + int(chunks[3], 2) * 0.1  # 信心水準 0.3-0.7
-        }
+        return self.decode_population(self.to_array([chromosome]))[0]
 
     def select_parents(self, population: List[str], fitness_values: List[float]) -> Tuple[str, str]:
         """改進的父代選擇機制"""
@@ -149,7 +1167,7 @@ class GeneticAlgorithm:
             
             if len(valid_pairs) < 2:
                 # 如果有效配對不足，隨機選擇
-                return tuple(random.sample(population, 2))
+                return tuple(self.random.sample(population, 2))
             
             valid_population, valid_fitness = zip(*valid_pairs)
             
@@ -158,7 +1176,7 @@ class GeneticAlgorithm:
             max_fitness = max(valid_fitness)
             
             if max_fitness == min_fitness:
-                return tuple(random.sample(valid_population, 2))
+                return tuple(self.random.sample(valid_population, 2))
                 
             normalized_fitness = [(f - min_fitness) / (max_fitness - min_fitness) + 1e-6 
                                 for f in valid_fitness]
@@ -167,7 +1185,7 @@ class GeneticAlgorithm:
             total_fitness = sum(normalized_fitness)
             probabilities = [f/total_fitness for f in normalized_fitness]
             
-            selected_indices = np.random.choice(
+            selected_indices = self.rng.choice(
                 len(valid_population),
                 size=2,
                 p=probabilities,
@@ -179,46 +1197,296 @@ class GeneticAlgorithm:
                     
         except Exception as e:
             logging.error(f"Parent selection error: {e}")
-            return tuple(random.sample(population, 2))
+            return tuple(self.random.sample(population, 2))
+
+    def select_parents_array(self, fitness_values: np.ndarray, num_pairs: int) -> np.ndarray:
+        """一次為所有配對以輪盤法選出兩個不同的父代索引，回傳形狀 (配對數, 2)"""
+        fitness_values = np.asarray(fitness_values, dtype=float)
+        valid = np.flatnonzero(np.isfinite(fitness_values))
+
+        if len(valid) < 2:
+            # 如果有效配對不足，隨機選擇
+            candidates = np.arange(len(fitness_values))
+            probabilities = np.full(len(candidates), 1 / len(candidates))
+        else:
+            candidates = valid
+            valid_fitness = fitness_values[valid]
+            min_fitness, max_fitness = valid_fitness.min(), valid_fitness.max()
+            if max_fitness == min_fitness:
+                probabilities = np.full(len(candidates), 1 / len(candidates))
+            else:
+                # 適應度值標準化後使用輪盤法
+                normalized_fitness = (valid_fitness - min_fitness) / (max_fitness - min_fitness) + 1e-6
+                probabilities = normalized_fitness / normalized_fitness.sum()
+
+        n = len(candidates)
+        cumulative = np.cumsum(probabilities)
+        first = np.minimum(np.searchsorted(cumulative, self.rng.random(num_pairs) * cumulative[-1],
+                                           side='right'), n - 1)
+
+        # 第二個父代從排除第一個後的分佈抽出 (不放回抽樣)：在去掉第一個的累積分佈上取樣
+        excluded = probabilities[first]
+        targets = self.rng.random(num_pairs) * (cumulative[-1] - excluded)
+        targets += np.where(targets >= cumulative[first] - excluded, excluded, 0)
+        second = np.minimum(np.searchsorted(cumulative, targets, side='right'), n - 1)
+        second = np.where(second == first, (first + 1) % n, second)  # 浮點誤差時的保護
+
+        return candidates[np.stack([first, second], axis=1)]
 
     def crossover(self, parent1: str, parent2: str) -> Tuple[str, str]:
-        if random.random() < self.crossover_rate:
-            point = random.randint(1, self.chromosome_length-1)
+        if self.random.random() < self.crossover_rate:
+            point = self.random.randint(1, self.chromosome_length-1)
             child1 = parent1[:point] + parent2[point:]
             child2 = parent2[:point] + parent1[point:]
             return child1, child2
         return parent1, parent2
 
+    def crossover_array(self, parents1: np.ndarray, parents2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """整批單點交配：每個配對依交配率決定是否交換交配點之後的位元"""
+        num_pairs = len(parents1)
+        points = self.rng.integers(1, self.chromosome_length, size=num_pairs)
+        points[self.rng.random(num_pairs) >= self.crossover_rate] = self.chromosome_length
+        swap = np.arange(self.chromosome_length) >= points[:, None]
+        return np.where(swap, parents2, parents1), np.where(swap, parents1, parents2)
+
     def mutate(self, chromosome: str) -> str:
-        if random.random() < self.mutation_rate:
-            point = random.randint(0, self.chromosome_length-1)
+        if self.random.random() < self.mutation_rate:
+            point = self.random.randint(0, self.chromosome_length-1)
             chromosome_list = list(chromosome)
             chromosome_list[point] = '1' if chromosome_list[point] == '0' else '0'
             return ''.join(chromosome_list)
         return chromosome
 
-    def evolve(self, fitness_func):
-        population = self.initialize_population()
+    def mutate_array(self, population: np.ndarray) -> np.ndarray:
+        """整批突變：每個染色體依突變率翻轉一個隨機位元"""
+        rows = np.flatnonzero(self.rng.random(len(population)) < self.mutation_rate)
+        points = self.rng.integers(0, self.chromosome_length, size=len(rows))
+        population = population.copy()
+        population[rows, points] ^= 1
+        return population
+
+    @staticmethod
+    def params_key(params: dict) -> tuple:
+        """將解碼後的參數轉為可雜湊的快取鍵"""
+        return tuple(sorted(params.items()))
+
+    def reset_cache(self):
+        self.fitness_cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def evaluate(self, fitness_func, chromosome: str) -> float:
+        """計算染色體適應度，相同參數組合只計算一次"""
+        return self.evaluate_population(fitness_func, [chromosome])[0]
+
+    def evaluate_population(self, fitness_func, population: List[str],
+                            batch_fitness_func=None) -> List[float]:
+        """計算字串族群的適應度 (見 evaluate_population_array)"""
+        return self.evaluate_population_array(fitness_func, self.to_array(population),
+                                              batch_fitness_func).tolist()
+
+    def evaluate_population_array(self, fitness_func, population: np.ndarray,
+                                  batch_fitness_func=None) -> np.ndarray:
+        """計算整個族群的適應度；只對未快取的不同參數組合計算一次。
+        有批次函式時，未快取的參數只呼叫一次批次計算"""
+        unique_genes, inverse, counts = np.unique(self.population_genes(population), axis=0,
+                                                  return_inverse=True, return_counts=True)
+        decoded = self.decode_genes(unique_genes)
+
+        keys = []
+        pending = {}
+        for i, count in enumerate(counts):
+            params = {name: decoded[name][i].item() for name in decoded}
+            key = self.params_key(params)
+            keys.append(key)
+            if key in self.fitness_cache or key in pending:
+                self.cache_hits += int(count)
+            else:
+                self.cache_misses += 1
+                self.cache_hits += int(count) - 1
+                pending[key] = params
+
+        metrics.increment('fitness_cache_hits', int(counts.sum()) - len(pending))
+        if pending:
+            metrics.increment('fitness_evaluations', len(pending))
+            params_list = list(pending.values())
+            start = time.perf_counter()
+            if batch_fitness_func is None:
+                scores = [fitness_func(params) for params in params_list]
+            else:
+                scores = batch_fitness_func(params_list)
+            metrics.observe('fitness_evaluation', time.perf_counter() - start)
+            self.fitness_cache.update(zip(pending.keys(), scores))
+
+        unique_fitness = np.array([self.fitness_cache[key] for key in keys], dtype=float)
+        return unique_fitness[inverse.reshape(-1)]
+
+    def parameter_space_size(self) -> int:
+        return 2 ** (self.bits_per_gene * len(self.PARAM_GENES))
+
+    def parameter_space(self) -> List[str]:
+        """列舉所有參數組合各自的代表染色體 (依二進位順序，去除重複的解碼結果)"""
+        gene_bits = self.bits_per_gene * len(self.PARAM_GENES)
+        padding = '0' * (self.chromosome_length - gene_bits)
+        chromosomes = {}
+        for value in range(2 ** gene_bits):
+            chromosome = format(value, f'0{gene_bits}b') + padding
+            key = self.params_key(self.decode_chromosome(chromosome))
+            chromosomes.setdefault(key, chromosome)
+        return list(chromosomes.values())
+
+    def search_exhaustive(self, fitness_func, batch_fitness_func=None):
+        """對整個參數空間各計算一次適應度，直接取得真正的最佳解"""
+        space = self.parameter_space()
+        fitness_values = self.evaluate_population(fitness_func, space, batch_fitness_func)
+        for chromosome, fitness in zip(space, fitness_values):
+            if fitness > self.best_fitness:
+                self.best_fitness = fitness
+                self.best_solution = chromosome
+
+        print(f"Exhaustive search: {len(self.fitness_cache)} 組參數, "
+              f"Best Fitness = {self.best_fitness:.4f}")
+
+    def state(self) -> dict:
+        """可保存的演化狀態 (最後族群、最佳解與適應度歷程)，供下次 warm_start 使用"""
+        return {
+            'chromosome_length': self.chromosome_length,
+            'bits_per_gene': self.bits_per_gene,
+            'population': None if self.population is None else self.population.copy(),
+            'best_solution': self.best_solution,
+            'best_fitness': self.best_fitness,
+            'fitness_history': list(self.fitness_history)
+        }
+
+    def warm_start(self, state: dict, fresh_fraction: float = 0.2, confirm_generations: int = 3) -> bool:
+        """以前次 state() 作為下一次 evolve 的起點 (只套用一次，evolve 結束後清除)；編碼不相容時忽略並回傳 False
+
+        初始族群為前次的最佳解、前次族群，以及 fresh_fraction 比例的新隨機個體；
+        前次最佳參數連續 confirm_generations 代仍是最佳解時即視為確認而停止。
+        """
+        if (state.get('chromosome_length') != self.chromosome_length
+                or state.get('bits_per_gene') != self.bits_per_gene
+                or state.get('population') is None):
+            return False
+        self._warm_state = state
+        self._fresh_fraction = fresh_fraction
+        self._confirm_generations = confirm_generations
+        return True
+
+    def seed_population(self) -> np.ndarray:
+        """evolve 的初始族群：有 warm_start 狀態時由前次族群加上新隨機個體組成，否則全部隨機"""
+        population = self.initialize_population_array()
+        if self._warm_state is None:
+            return population
+
+        num_fresh = min(self.population_size, max(1, round(self.population_size * self._fresh_fraction)))
+        carried = [np.asarray(self._warm_state['population'], dtype=np.uint8)]
+        if self._warm_state.get('best_solution') is not None:
+            carried.insert(0, self.to_array([self._warm_state['best_solution']]))
+        carried = np.concatenate(carried)[:self.population_size - num_fresh]
+        population[:len(carried)] = carried
+        return population
+
+    def prior_optimum_confirmed(self, stagnant: int) -> bool:
+        """目前最佳解與前次最佳解的參數相同，且已連續 confirm_generations 代沒有更好的解"""
+        if self._warm_state is None or self._warm_state.get('best_solution') is None:
+            return False
+        if self.best_solution is None or stagnant < self._confirm_generations - 1:
+            return False
+        return (self.params_key(self.decode_chromosome(self.best_solution))
+                == self.params_key(self.decode_chromosome(self._warm_state['best_solution'])))
+
+    def population_diversity(self, population: np.ndarray) -> float:
+        """族群在參數位元上的多樣性：每個位元 4p(1-p) 的平均，全部相同為 0，各位元 0/1 各半為 1"""
+        p = population[:, :self.bits_per_gene * len(self.PARAM_GENES)].mean(axis=0)
+        return float(np.mean(4 * p * (1 - p)))
+
+    def stop_reason(self, stagnant: int, diversity: float, elapsed: float) -> Optional[str]:
+        """依早停條件與預算判斷是否停止演化，回傳停止原因 (不停止時為 None)"""
+        if self.prior_optimum_confirmed(stagnant):
+            return 'confirmed'
+        if self.max_evaluations is not None and self.cache_misses >= self.max_evaluations:
+            return 'evaluation_budget'
+        if self.max_seconds is not None and elapsed >= self.max_seconds:
+            return 'time_budget'
+        if self.stagnation_generations is not None and stagnant >= self.stagnation_generations:
+            return 'stagnation'
+        if diversity < self.min_diversity:
+            return 'diversity'
+        return None
+
+    def evolve(self, fitness_func, exhaustive: Optional[bool] = None,
+               batch_fitness_func=None,
+               progress_callback=None, cancel_event: Optional[threading.Event] = None):
+        """執行演化；有 batch_fitness_func 時每代未快取的參數以一次批次呼叫計算適應度
+
+        progress_callback 於每一代結束時以 (generation, best_fitness, best_params) 呼叫；
+        cancel_event 被設定時於下一代開始前拋出 EvolutionCancelled。
+        warm_start 設定的狀態只用於這一次 evolve，不論成功、取消或失敗都會清除
+        """
+        try:
+            self._evolve(fitness_func, exhaustive, batch_fitness_func, progress_callback, cancel_event)
+        finally:
+            self._warm_state = None
+
+    def _evolve(self, fitness_func, exhaustive: Optional[bool], batch_fitness_func,
+                progress_callback, cancel_event: Optional[threading.Event]):
+        self.reset_cache()
+        if self.seed is not None:
+            self.reset_rng()
+        start = time.perf_counter()
+
+        if exhaustive is None:
+            exhaustive = self.exhaustive
+        if exhaustive:
+            if self.parameter_space_size() <= self.max_exhaustive_size:
+                self.search_exhaustive(fitness_func, batch_fitness_func)
+                self.run_summary = {
+                    'generations': 0,
+                    'evaluations': self.cache_misses,
+                    'cache_hits': self.cache_hits,
+                    'stop_reason': 'exhaustive',
+                    'seconds': time.perf_counter() - start,
+                    'best_fitness': self.best_fitness
+                }
+                return
+            logging.warning(f"參數空間 {self.parameter_space_size()} 超過窮舉上限 "
+                            f"{self.max_exhaustive_size}，改用遺傳算法")
+
+        population = self.seed_population()
+        self.fitness_history = []
+        generations_used = 0
+        stagnant = 0
+        reason = 'completed'
         
         for generation in range(self.generations):
+            if cancel_event is not None and cancel_event.is_set():
+                raise EvolutionCancelled(f"演化於第 {generation} 代取消")
             try:
-                fitness_values = [fitness_func(self.decode_chromosome(chrom)) 
-                                for chrom in population]
+                fitness_values = self.evaluate_population_array(fitness_func, population,
+                                                                batch_fitness_func)
                 
+                metrics.increment('ga_generations')
+                generations_used += 1
                 max_fitness_idx = np.argmax(fitness_values)
                 if fitness_values[max_fitness_idx] > self.best_fitness:
-                    self.best_fitness = fitness_values[max_fitness_idx]
-                    self.best_solution = population[max_fitness_idx]
-                
-                new_population = []
-                for _ in range(self.population_size // 2):
-                    parent1, parent2 = self.select_parents(population, fitness_values)
-                    child1, child2 = self.crossover(parent1, parent2)
-                    child1 = self.mutate(child1)
-                    child2 = self.mutate(child2)
-                    new_population.extend([child1, child2])
+                    self.best_fitness = float(fitness_values[max_fitness_idx])
+                    self.best_solution = self.to_string(population[max_fitness_idx])
+                    stagnant = 0
+                else:
+                    stagnant += 1
+                self.fitness_history.append(self.best_fitness)
+                diversity = self.population_diversity(population)
                 
-                population = new_population
+                parents = self.select_parents_array(fitness_values, self.population_size // 2)
+                children1, children2 = self.crossover_array(population[parents[:, 0]],
+                                                            population[parents[:, 1]])
+                children = self.mutate_array(np.concatenate([children1, children2]))
+                if self.elitism:
+                    # 菁英直接進入下一代，取代子代尾端
+                    elites = population[np.argsort(-fitness_values, kind='stable')[:self.elitism]]
+                    children = np.concatenate([elites, children[:len(children) - self.elitism]])
+                population = children
                 
                 if generation % 10 == 0:
                     print(f"Generation {generation}: Best Fitness = {self.best_fitness:.4f}")
@@ -227,105 +1495,202 @@ class GeneticAlgorithm:
                 print(f"Evolution error in generation {generation}: {e}")
                 continue
 
+            if progress_callback is not None:
+                best_params = (self.decode_chromosome(self.best_solution)
+                               if self.best_solution is not None else None)
+                progress_callback(generation, self.best_fitness, best_params)
+
+            stop = self.stop_reason(stagnant, diversity, time.perf_counter() - start)
+            if stop is not None:
+                reason = stop
+                break
+
+        self.population = population
+        self.run_summary = {
+            'generations': generations_used,
+            'evaluations': self.cache_misses,
+            'cache_hits': self.cache_hits,
+            'stop_reason': reason,
+            'seconds': time.perf_counter() - start,
+            'best_fitness': self.best_fitness
+        }
+        logging.info(f"演化 {generations_used}/{self.generations} 代後停止 ({reason})，"
+                     f"適應度快取命中 {self.cache_hits} 次，實際計算 {self.cache_misses} 次")
+
+class GAStateStore:
+    """每檔股票的遺傳算法狀態 (GeneticAlgorithm.state() 加上資料日期與歷次執行摘要)，存成 root/<代號>.pkl"""
+
+    MAX_RUNS = 250  # 保留的歷次執行摘要筆數
+
+    def __init__(self, root: str = 'ga_state'):
+        self.root = root
+
+    def _path(self, symbol: str) -> str:
+        return os.path.join(self.root, f"{symbol}.pkl")
+
+    def load(self, symbol: str) -> Optional[dict]:
+        try:
+            with open(self._path(symbol), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"讀取 {symbol} 的遺傳算法狀態失敗，重新開始: {e}")
+            return None
+
+    def save(self, symbol: str, ga: GeneticAlgorithm, as_of=None):
+        previous = self.load(symbol) or {}
+        state = ga.state()
+        state['as_of'] = as_of
+        state['runs'] = (previous.get('runs', []) + [dict(ga.run_summary, as_of=as_of)])[-self.MAX_RUNS:]
+
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f'{symbol}.', suffix='.tmp', dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, self._path(symbol))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
 class StockAnalyzer:
+    GA_GENERATIONS = 50  # 減少世代數以加快運算
+
     def __init__(self,
                  symbol: str,
                  holding_period: int = 10,
                  num_intervals: int = 5,
                  target_profit_ratio: float = 0.8,
                  confidence_threshold: float = 0.6,
-                 years_of_history: int = 5):
+                 years_of_history: int = 5,
+                 bar_store: Optional[BarStore] = None):
         self.symbol = symbol
         self.holding_period = holding_period
         self.num_intervals = num_intervals
         self.target_profit_ratio = target_profit_ratio
         self.confidence_threshold = confidence_threshold
         self.years_of_history = years_of_history
+        self.bar_store = bar_store if bar_store is not None else BarStore()
         
         self.logger = logging.getLogger(__name__)
-        self.historical_data = None
+        self._prices: Optional[PriceSeries] = None  # 只保留精簡的價格序列，不保留完整的日K DataFrame
         self.trading_intervals = None
-        self.ga = GeneticAlgorithm(generations=50)  # 減少世代數以加快運算
+        self.ga = GeneticAlgorithm(generations=self.GA_GENERATIONS, elitism=2,
+                                   stagnation_generations=20, min_diversity=0.01)
+        self._fitness_tables = None
+
+    def parameters(self) -> dict:
+        """目前的分析參數 (與 decode_chromosome 相同的鍵)"""
+        return {
+            'intervals': self.num_intervals,
+            'holding_period': self.holding_period,
+            'target_profit_ratio': self.target_profit_ratio,
+            'confidence_threshold': self.confidence_threshold
+        }
 
     def fitness_function(self, params: dict) -> float:
-        """改進的適應度計算"""
-        try:
-            # 參數合理性檢查
-            if not all(isinstance(v, (int, float)) for v in params.values()):
-                return float('-inf')
-                
-            self.num_intervals = max(3, min(6, params['intervals']))
-            self.holding_period = max(5, min(25, params['holding_period']))
-            self.target_profit_ratio = max(0.5, min(1.3, params['target_profit_ratio']))
-            self.confidence_threshold = max(0.3, min(0.7, params['confidence_threshold']))
-            
-            self.analyze_profit_patterns()
-            
-            buy_signals = [interval for interval in self.trading_intervals 
-                          if interval.is_buy_signal]
-            
-            if not buy_signals:
-                return float('-inf')
-                
-            # 計算綜合得分
-            total_profit = sum(interval.avg_profit for interval in buy_signals)
-            avg_probability = np.mean([interval.profit_probability for interval in buy_signals])
-            avg_sample_size = np.mean([interval.sample_size for interval in buy_signals])
-            
-            # 加入風險調整因子
-            risk_factor = 1.0 - np.std([interval.avg_profit for interval in buy_signals]) / (total_profit + 1e-6)
-            
-            score = (total_profit * avg_probability * np.log1p(avg_sample_size) * max(0.1, risk_factor))
-            
-            return float('-inf') if np.isnan(score) or np.isinf(score) else score
-            
-        except Exception as e:
-            logging.error(f"Fitness calculation error: {e}")
-            return float('-inf')
+        """改進的適應度計算 (不會修改分析器的參數)"""
+        return self.fitness_batch([params])[0]
+
+    def fitness_tables(self) -> dict:
+        """預先計算的適應度表格，資料更新時重建"""
+        prices = self.prices
+        if self._fitness_tables is None or self._fitness_tables['source'] is not prices:
+            self._fitness_tables = build_fitness_tables(*prices.arrays())
+            self._fitness_tables['source'] = prices
+        return self._fitness_tables
+
+    @property
+    def prices(self) -> PriceSeries:
+        """分析使用的精簡價格序列 (含快取的最高/最低價)，尚未取得資料時先 fetch_data"""
+        if self._prices is None:
+            self.fetch_data()
+        return self._prices
+
+    @property
+    def historical_data(self) -> Optional[pd.DataFrame]:
+        """由 prices 臨時組成的日K DataFrame (只有收盤、最高、最低價)，尚未取得資料時為 None
+
+        指定 DataFrame 時轉為 PriceSeries 保存，不保留原本的 DataFrame
+        """
+        return None if self._prices is None else self._prices.to_frame()
+
+    @historical_data.setter
+    def historical_data(self, data: Optional[pd.DataFrame]):
+        self._prices = None if data is None else PriceSeries.from_frame(data)
+
+    def price_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """取出分析所需的收盤、最高、最低價陣列"""
+        return self.prices.arrays()
+
+    def fitness_batch(self, params_list: List[dict]) -> List[float]:
+        """一次計算整個世代的適應度，共用預先計算的表格"""
+        tables = self.fitness_tables()
+        return [fitness_from_tables(tables, params) for params in params_list]
 
     def fetch_data(self) -> pd.DataFrame:
-        """改進的資料擷取功能"""
+        """改進的資料擷取功能：優先讀取本地資料庫，只向資料來源補抓新的交易日"""
         max_retries = 3
         retry_delay = 2
         
         for attempt in range(max_retries):
             try:
-                ticker = yf.Ticker(f"{self.symbol}.TW")
-                data = ticker.history(period=f"{self.years_of_history}y")
-                
-                if data.empty:
-                    raise ValueError(f"無法取得股票 {self.symbol} 的資料")
-                    
-                # 檢查資料品質
-                if len(data) < 20:  # 至少需要20個交易日的資料
-                    raise ValueError(f"股票 {self.symbol} 的資料量不足")
-                    
-                # 檢查是否有遺漏值
-                if data.isnull().any().any():
-                    data = data.fillna(method='ffill').fillna(method='bfill')
-                    
-                self.historical_data = data
-                return self.historical_data
+                self.bar_store.refresh(self.symbol, self.years_of_history)
+                break
                 
             except Exception as e:
+                if self.bar_store.last_date(self.symbol) is not None:
+                    # 已有本地資料時不再重試，直接使用現有資料
+                    logging.warning(f"更新 {self.symbol} 資料失敗，使用本地資料: {e}")
+                    break
                 if attempt < max_retries - 1:
                     logging.warning(f"第 {attempt + 1} 次嘗試取得 {self.symbol} 資料失敗: {e}")
+                    metrics.increment('fetch_retries')
                     time.sleep(retry_delay)
                 else:
                     logging.error(f"無法取得 {self.symbol} 資料: {e}")
                     raise
 
-    def calculate_price_intervals(self) -> List[Tuple[float, float]]:
-        price_range = self.historical_data['High'].max() - self.historical_data['Low'].min()
-        interval_length = price_range / self.num_intervals
-        min_price = self.historical_data['Low'].min()
+        start = pd.Timestamp.today().normalize() - pd.DateOffset(years=self.years_of_history)
+        data = self.bar_store.read(self.symbol, start=start)
+        
+        if data.empty:
+            raise ValueError(f"無法取得股票 {self.symbol} 的資料")
+            
+        # 檢查資料品質
+        if len(data) < 20:  # 至少需要20個交易日的資料
+            raise ValueError(f"股票 {self.symbol} 的資料量不足")
+            
+        # 檢查是否有遺漏值
+        if data.isnull().any().any():
+            data = data.ffill().bfill()
+            
+        metrics.increment('bars_processed', len(data))
+        self.historical_data = data
+        return data
 
-        return [(min_price + i * interval_length,
-                min_price + (i + 1) * interval_length)
-                for i in range(self.num_intervals)]
+    def calculate_price_intervals(self, num_intervals: Optional[int] = None) -> List[Tuple[float, float]]:
+        if num_intervals is None:
+            num_intervals = self.num_intervals
+        return price_intervals(self.prices.high_max, self.prices.low_min, num_intervals)
 
     def analyze_profit_patterns(self) -> List[TradingInterval]:
-        if self.historical_data is None:
+        if self._prices is None:
+            self.fetch_data()
+
+        self.trading_intervals = compute_trading_intervals(
+            self.prices.close,
+            self.calculate_price_intervals(),
+            self.holding_period,
+            self.target_profit_ratio,
+            self.confidence_threshold
+        )
+        return self.trading_intervals
+
+    def _analyze_profit_patterns_loop(self) -> List[TradingInterval]:
+        """逐筆迴圈的原始實作，保留作為向量化版本的對照與效能基準"""
+        if self._prices is None:
             self.fetch_data()
 
         intervals = self.calculate_price_intervals()
@@ -363,12 +1728,64 @@ class StockAnalyzer:
                     is_buy_signal=is_buy_signal
                 ))
 
-        self.trading_intervals = trading_intervals
         return trading_intervals
 
-    def optimize_parameters(self):
-        """使用遺傳算法優化參數"""
-        self.ga.evolve(self.fitness_function)
+    def walk_forward(self, train_window: int = 250) -> np.ndarray:
+        """以目前參數進行逐日滑動視窗的樣本外回測，回傳 WALK_FORWARD_DTYPE 結構陣列
+
+        每個決策日的價格區間只由訓練視窗 (到當日為止) 的最高/最低價決定，不含未來資料
+        """
+        if self._prices is None:
+            self.fetch_data()
+
+        close, high, low = self.price_arrays()
+        return walk_forward_backtest(
+            close,
+            self.num_intervals,
+            self.holding_period,
+            self.target_profit_ratio,
+            self.confidence_threshold,
+            train_window,
+            high_prices=high,
+            low_prices=low
+        )
+
+    def current_interval(self) -> Optional[TradingInterval]:
+        """找出最新收盤價所在的交易區間 (不在任何區間時回傳 None)"""
+        if self.trading_intervals is None:
+            self.analyze_profit_patterns()
+
+        price = self.prices.close[-1]
+        for interval in self.trading_intervals:
+            if interval.lower_bound <= price < interval.upper_bound:
+                return interval
+        return None
+
+    def save_rules(self, rule_table: Optional['RuleTable'] = None):
+        """將目前的交易區間與參數寫入規則表，供 SignalEvaluator 判斷即時報價"""
+        if self.trading_intervals is None:
+            self.analyze_profit_patterns()
+        (rule_table if rule_table is not None else RuleTable()).save(
+            self.symbol, self.trading_intervals, self.parameters())
+
+    def optimize_parameters(self, exhaustive: bool = False,
+                            progress_callback=None, cancel_event: Optional[threading.Event] = None,
+                            state_store: Optional[GAStateStore] = None):
+        """使用遺傳算法優化參數 (exhaustive=True 時窮舉整個參數空間)
+
+        progress_callback 與 cancel_event 直接傳給 GeneticAlgorithm.evolve；
+        指定 state_store 時以該股票前次保存的族群暖啟動，完成後保存這次的狀態
+        """
+        if state_store is not None:
+            state = state_store.load(self.symbol)
+            if state is not None and self.ga.warm_start(state):
+                logging.info(f"{self.symbol} 以 {state.get('as_of')} 的遺傳算法狀態暖啟動")
+
+        self.ga.evolve(self.fitness_function, exhaustive=exhaustive,
+                       batch_fitness_func=self.fitness_batch,
+                       progress_callback=progress_callback, cancel_event=cancel_event)
+        if state_store is not None:
+            state_store.save(self.symbol, self.ga, as_of=self.prices.index[-1])
         best_params = self.ga.decode_chromosome(self.ga.best_solution)
         
         # 更新最佳參數
@@ -377,6 +1794,9 @@ class StockAnalyzer:
         self.target_profit_ratio = best_params['target_profit_ratio']
         self.confidence_threshold = best_params['confidence_threshold']
 
+        # 適應度計算會覆寫區間結果，以最佳參數重新分析
+        self.analyze_profit_patterns()
+
     def generate_trading_rules(self) -> List[str]:
         """生成交易規則"""
         if self.trading_intervals is None:
@@ -397,99 +1817,964 @@ class StockAnalyzer:
 
         return rules
 
-    def plot_analysis(self) -> plt.Figure:
-        """繪製分析圖表"""
+    def chart_payload(self, samples: Optional[int] = 1000) -> dict:
+        """圖表所需資料 (可直接轉為 JSON 交由瀏覽器繪製)，股價先經 min-max 降採樣"""
         if self.trading_intervals is None:
             self.analyze_profit_patterns()
 
-        fig = plt.figure(figsize=(12, 8))
-        
-        # 股價走勢
-        ax1 = plt.subplot(2, 1, 1)
-        ax1.plot(self.historical_data.index, self.historical_data['Close'],
-                 label='收盤價', color='blue', linewidth=1)
-        
-        ax1.set_title(f'股票 {self.symbol} 股價走勢與交易區間分析', fontsize=12, pad=20)
-        ax1.set_ylabel('股價', fontsize=10)
-        ax1.grid(True, linestyle='--', alpha=0.7)
-        ax1.legend()
+        return build_chart_payload(self.symbol,
+                                   self.prices.index,
+                                   self.prices.close,
+                                   self.trading_intervals,
+                                   self.confidence_threshold,
+                                   samples)
 
-        # 標記買進區間
-        for interval in self.trading_intervals:
-            color = 'lightgreen' if interval.is_buy_signal else 'lightcoral'
-            alpha = 0.3 if interval.is_buy_signal else 0.2
-            ax1.axhspan(interval.lower_bound, interval.upper_bound,
-                       color=color, alpha=alpha)
-            ax1.text(self.historical_data.index[-1],
-                    (interval.lower_bound + interval.upper_bound)/2,
-                    f'{interval.lower_bound:.0f}-{interval.upper_bound:.0f}',
-                    verticalalignment='center')
-
-        # 獲利機率分布
-        ax2 = plt.subplot(2, 1, 2)
-        intervals = [f"{i.lower_bound:.0f}-{i.upper_bound:.0f}"
-                    for i in self.trading_intervals]
-        probs = [i.profit_probability * 100 for i in self.trading_intervals]
-        colors = ['lightgreen' if i.is_buy_signal else 'lightcoral'
-                  for i in self.trading_intervals]
-
-        # 繼續 plot_analysis 方法
-        bars = ax2.bar(intervals, probs, color=colors)
-        ax2.axhline(y=self.confidence_threshold * 100,
-                    color='black', linestyle='--', label='信心水準')
-
-        # 在柱狀圖上添加數值標籤
-        for bar in bars:
-            height = bar.get_height()
-            ax2.text(bar.get_x() + bar.get_width()/2., height,
-                    f'{height:.1f}%',
-                    ha='center', va='bottom')
-
-        ax2.set_title('各價格區間獲利機率分析', fontsize=12, pad=20)
-        ax2.set_ylabel('獲利機率 (%)', fontsize=10)
-        ax2.set_xticklabels(intervals, rotation=45)
-        ax2.grid(True, linestyle='--', alpha=0.7)
-        ax2.legend()
-
-        plt.tight_layout()
-        return fig
-
-def analyze_stock(stock_option: str, use_genetic: bool = False) -> Tuple[str, plt.Figure]:
-    """分析股票並返回結果"""
+    def plot_analysis(self, samples: Optional[int] = 1000) -> 'Figure':
+        """繪製分析圖表"""
+        return render_analysis_chart(self.chart_payload(samples))
+
+    def render_chart(self, format: str = 'png', samples: Optional[int] = 1000):
+        """回傳 PNG 位元組 (format='png') 或 JSON 可序列化的圖表資料 (format='json')"""
+        payload = self.chart_payload(samples)
+        if format == 'json':
+            return payload
+        if format == 'png':
+            return render_analysis_png(payload)
+        raise ValueError(f"不支援的圖表格式: {format}")
+
+def decimate_min_max(values: np.ndarray, samples: int = 1000) -> np.ndarray:
+    """min-max 降採樣 (與 js/main.js 中 Chart.js 的 decimation 設定相同)，回傳保留點的索引
+
+    將序列切成 samples / 2 段，每段保留最低與最高點，並保留首尾兩點。
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if samples is None or n <= samples:
+        return np.arange(n)
+
+    buckets = max(1, samples // 2)
+    bucket_size = -(-n // buckets)
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(buckets, bucket_size)
+    filled = ~np.all(np.isnan(padded), axis=1)
+
+    offsets = np.arange(buckets)[filled] * bucket_size
+    mins = np.nanargmin(padded[filled], axis=1) + offsets
+    maxs = np.nanargmax(padded[filled], axis=1) + offsets
+    return np.unique(np.concatenate([[0, n - 1], mins, maxs]))
+
+def build_chart_payload(symbol: str,
+                        dates,
+                        close_prices: np.ndarray,
+                        trading_intervals: List[TradingInterval],
+                        confidence_threshold: float,
+                        samples: Optional[int] = 1000) -> dict:
+    """組成圖表資料：降採樣後的收盤價與各區間統計，所有值皆為 JSON 可序列化的型別"""
+    close = np.asarray(close_prices, dtype=float)
+    keep = decimate_min_max(close, samples)
+    return {
+        'symbol': symbol,
+        'dates': pd.DatetimeIndex(dates)[keep].strftime('%Y-%m-%d').tolist(),
+        'close': close[keep].tolist(),
+        'confidence_threshold': float(confidence_threshold),
+        'intervals': [{
+            'lower_bound': float(interval.lower_bound),
+            'upper_bound': float(interval.upper_bound),
+            'avg_profit': float(interval.avg_profit),
+            'profit_probability': float(interval.profit_probability),
+            'sample_size': int(interval.sample_size),
+            'is_buy_signal': bool(interval.is_buy_signal)
+        } for interval in trading_intervals]
+    }
+
+def render_analysis_chart(payload: dict) -> 'Figure':
+    """以物件導向 API 繪製分析圖表；不經過 pyplot 的全域狀態，可在多個執行緒同時呼叫"""
+    dates = pd.to_datetime(payload['dates'])
+    trading_intervals = payload['intervals']
+
+    Figure, FigureCanvasAgg = _matplotlib()
+    fig = Figure(figsize=(12, 8))
+    FigureCanvasAgg(fig)
+
+    # 股價走勢
+    ax1 = fig.add_subplot(2, 1, 1)
+    ax1.plot(dates, payload['close'], label='收盤價', color='blue', linewidth=1)
+
+    ax1.set_title(f"股票 {payload['symbol']} 股價走勢與交易區間分析", fontsize=12, pad=20)
+    ax1.set_ylabel('股價', fontsize=10)
+    ax1.grid(True, linestyle='--', alpha=0.7)
+    ax1.legend()
+
+    # 標記買進區間
+    for interval in trading_intervals:
+        color = 'lightgreen' if interval['is_buy_signal'] else 'lightcoral'
+        alpha = 0.3 if interval['is_buy_signal'] else 0.2
+        ax1.axhspan(interval['lower_bound'], interval['upper_bound'],
+                    color=color, alpha=alpha)
+        ax1.text(dates[-1],
+                 (interval['lower_bound'] + interval['upper_bound'])/2,
+                 f"{interval['lower_bound']:.0f}-{interval['upper_bound']:.0f}",
+                 verticalalignment='center')
+
+    # 獲利機率分布
+    ax2 = fig.add_subplot(2, 1, 2)
+    labels = [f"{i['lower_bound']:.0f}-{i['upper_bound']:.0f}" for i in trading_intervals]
+    probs = [i['profit_probability'] * 100 for i in trading_intervals]
+    colors = ['lightgreen' if i['is_buy_signal'] else 'lightcoral' for i in trading_intervals]
+
+    bars = ax2.bar(labels, probs, color=colors)
+    ax2.axhline(y=payload['confidence_threshold'] * 100,
+                color='black', linestyle='--', label='信心水準')
+
+    # 在柱狀圖上添加數值標籤
+    for bar in bars:
+        height = bar.get_height()
+        ax2.text(bar.get_x() + bar.get_width()/2., height,
+                 f'{height:.1f}%',
+                 ha='center', va='bottom')
+
+    ax2.set_title('各價格區間獲利機率分析', fontsize=12, pad=20)
+    ax2.set_ylabel('獲利機率 (%)', fontsize=10)
+    ax2.tick_params(axis='x', labelrotation=45)
+    ax2.grid(True, linestyle='--', alpha=0.7)
+    ax2.legend()
+
+    fig.tight_layout()
+    return fig
+
+def render_analysis_png(payload: dict) -> bytes:
+    """繪製圖表並輸出 PNG，完成後立即釋放圖表"""
+    fig = render_analysis_chart(payload)
     try:
-        stock_code = stock_option.split(' - ')[0]
-        
-        # 創建分析器實例
-        analyzer = StockAnalyzer(symbol=stock_code)
-        
+        buffer = BytesIO()
+        fig.canvas.print_png(buffer)
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+def pack_price_matrix(histories: Dict[str, pd.DataFrame]) -> dict:
+    """將多檔股票的日K資料排成 (股票數, 天數) 的收盤價矩陣
+
+    每檔股票的資料靠左對齊 (第 t 欄為該股票自己的第 t 個交易日)，持有期間以各自的交易日計算，
+    與 StockAnalyzer 的結果一致；較短的序列以 NaN 補齊，mask 標示有效的格子。
+    """
+    symbols = list(histories)
+    lengths = np.array([len(histories[symbol]) for symbol in symbols], dtype=np.int64)
+    close = np.full((len(symbols), int(lengths.max()) if len(symbols) else 0), np.nan)
+    high_max = np.empty(len(symbols))
+    low_min = np.empty(len(symbols))
+    for i, symbol in enumerate(symbols):
+        data = histories[symbol]
+        close[i, :lengths[i]] = data['Close'].to_numpy(dtype=float)
+        high_max[i] = np.nanmax(data['High'].to_numpy(dtype=float))
+        low_min[i] = np.nanmin(data['Low'].to_numpy(dtype=float))
+    return {
+        'symbols': symbols,
+        'close': close,
+        'lengths': lengths,
+        'mask': np.arange(close.shape[1]) < lengths[:, None],
+        'high_max': high_max,
+        'low_min': low_min
+    }
+
+def cross_sectional_fitness(matrix: dict, params_list: List[dict]) -> np.ndarray:
+    """對 pack_price_matrix 的每檔股票同時計算每組參數的適應度，回傳 (股票數, 參數組數)
+
+    與 fitness_from_tables 相同的統計與評分：區間編號以廣播一次算出所有股票，
+    各區間的樣本數、平均獲利與達標次數以 (股票, 區間) 扁平編號的 bincount 一次彙總；
+    同一區間數 / 持有期間 / 目標比例的參數組共用中間結果。
+    """
+    close, mask = matrix['close'], matrix['mask']
+    high_max, low_min = matrix['high_max'], matrix['low_min']
+    num_symbols, num_days = close.shape
+    scores = np.full((num_symbols, len(params_list)), float('-inf'))
+
+    # 依 (區間數, 持有期間, 目標比例) 分組，組內只差信心水準
+    groups: Dict[tuple, List[Tuple[int, float]]] = {}
+    for column, params in enumerate(params_list):
+        clamped = clamp_params(params)
+        if clamped is None:
+            continue
+        num_intervals, holding_period, target_profit_ratio, confidence_threshold = clamped
+        groups.setdefault((num_intervals, holding_period, target_profit_ratio), []).append(
+            (column, confidence_threshold))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for num_intervals in sorted({key[0] for key in groups}):
+            # 與 price_intervals 相同的區間上下界，bins 與 assign_price_bins 相同
+            steps = np.arange(num_intervals)
+            interval_length = (high_max - low_min) / num_intervals
+            lowers = low_min[:, None] + steps * interval_length[:, None]
+            uppers = low_min[:, None] + (steps + 1) * interval_length[:, None]
+            bins = (close[:, :, None] >= lowers[:, None, :]).sum(axis=2) - 1
+            in_interval = bins >= 0
+            in_interval &= close < np.take_along_axis(uppers, np.maximum(bins, 0), axis=1)
+            widths = uppers - lowers
+
+            for holding_period in sorted({key[1] for key in groups if key[0] == num_intervals}):
+                span = num_days - holding_period
+                if span <= 0:
+                    continue
+                profits = close[:, holding_period:] - close[:, :span]
+                usable = in_interval[:, :span] & mask[:, holding_period:]
+
+                # 以 (股票, 區間) 的扁平編號做 bincount，一次彙總所有股票的各區間
+                cells = (np.arange(num_symbols)[:, None] * num_intervals + bins[:, :span])[usable]
+                cell_profits = profits[usable]
+                size = num_symbols * num_intervals
+                counts = np.bincount(cells, minlength=size).reshape(num_symbols, num_intervals)
+                avg_profit = (np.bincount(cells, weights=cell_profits, minlength=size)
+                              .reshape(num_symbols, num_intervals) / counts)
+                cell_widths = widths.ravel()[cells]
+
+                for key, columns in groups.items():
+                    if key[:2] != (num_intervals, holding_period):
+                        continue
+                    hits = np.bincount(cells, weights=cell_profits >= key[2] * cell_widths,
+                                       minlength=size).reshape(num_symbols, num_intervals)
+                    probability = hits / counts
+
+                    for column, confidence_threshold in columns:
+                        buy = (counts > 0) & (probability >= confidence_threshold)
+                        num_buy = buy.sum(axis=1)
+                        total_profit = np.where(buy, avg_profit, 0.0).sum(axis=1)
+                        mean_probability = np.where(buy, probability, 0.0).sum(axis=1) / num_buy
+                        mean_samples = np.where(buy, counts, 0).sum(axis=1) / num_buy
+                        deviation = avg_profit - (total_profit / num_buy)[:, None]
+                        std = np.sqrt(np.where(buy, deviation ** 2, 0.0).sum(axis=1) / num_buy)
+                        risk_factor = 1.0 - std / (total_profit + 1e-6)
+
+                        score = (total_profit * mean_probability * np.log1p(mean_samples)
+                                 * np.maximum(0.1, risk_factor))
+                        scores[:, column] = np.where((num_buy > 0) & np.isfinite(score),
+                                                     score, float('-inf'))
+    return scores
+
+def optimize_cross_section(histories: Dict[str, pd.DataFrame],
+                           ga: Optional['GeneticAlgorithm'] = None,
+                           chunk_size: int = 100) -> Dict[str, dict]:
+    """一次優化多檔股票：對 ga 的整個參數空間計算每檔股票的適應度，回傳 {代號: {'params', 'fitness'}}
+
+    參數空間與 GeneticAlgorithm.search_exhaustive 相同，同分時取空間中較前面的參數；
+    依 chunk_size 分批處理股票以限制記憶體用量。
+    """
+    ga = ga if ga is not None else GeneticAlgorithm()
+    params_list = [ga.decode_chromosome(chromosome) for chromosome in ga.parameter_space()]
+    symbols = list(histories)
+
+    results = {}
+    for start in range(0, len(symbols), chunk_size):
+        batch = symbols[start:start + chunk_size]
+        scores = cross_sectional_fitness(pack_price_matrix({symbol: histories[symbol] for symbol in batch}),
+                                         params_list)
+        best = np.argmax(scores, axis=1)
+        for row, symbol in enumerate(batch):
+            fitness = float(scores[row, best[row]])
+            results[symbol] = {
+                'params': params_list[best[row]] if np.isfinite(fitness) else None,
+                'fitness': fitness
+            }
+    return results
+
+def optimize_watchlist(symbols: List[str],
+                       years_of_history: int = 5,
+                       bar_store: Optional[BarStore] = None,
+                       fetch_workers: int = 8) -> Dict[str, StockAnalyzer]:
+    """批次更新並優化一組股票，回傳已套用最佳參數的 StockAnalyzer (取得資料失敗的股票略過)"""
+    if bar_store is None:
+        bar_store = BarStore()
+    bar_store.refresh_many(symbols, years_of_history, max_workers=fetch_workers)
+
+    analyzers = {}
+    for symbol in symbols:
+        analyzer = StockAnalyzer(symbol=symbol, years_of_history=years_of_history, bar_store=bar_store)
+        try:
+            analyzer.fetch_data()
+        except Exception as e:
+            logging.error(f"{symbol} 取得資料失敗，略過: {e}")
+            continue
+        analyzers[symbol] = analyzer
+
+    results = optimize_cross_section({symbol: analyzer.historical_data
+                                      for symbol, analyzer in analyzers.items()})
+    for symbol, analyzer in analyzers.items():
+        result = results[symbol]
+        if result['params'] is not None:
+            analyzer.num_intervals = result['params']['intervals']
+            analyzer.holding_period = result['params']['holding_period']
+            analyzer.target_profit_ratio = result['params']['target_profit_ratio']
+            analyzer.confidence_threshold = result['params']['confidence_threshold']
+        analyzer.ga.best_fitness = result['fitness']
+        analyzer.analyze_profit_patterns()
+    return analyzers
+
+RULE_DTYPE = np.dtype([
+    ('symbol', 'U8'),
+    ('lower', np.float64),
+    ('upper', np.float64),
+    ('avg_profit', np.float64),
+    ('probability', np.float64),
+    ('sample_size', np.int32),
+    ('is_buy', np.bool_),
+    ('holding_period', np.int16),           # 產生規則時的分析參數
+    ('target_profit_ratio', np.float32),
+    ('confidence_threshold', np.float32)
+])
+
+class RuleTable:
+    """所有股票已編譯的交易區間，存成依 (代號, 下界) 排序的單一結構化陣列 root/rules.npy
+
+    讀取時以 memmap 載入；更新某幾檔股票時只替換它們的列，再整批寫入暫存檔後換名，
+    整個讀取-合併-取代過程持有鎖，同時執行的多個行程不會互相覆蓋對方的股票。
+    """
+
+    _locks: Dict[str, threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, root: str = 'rule_tables'):
+        self.root = root
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root, 'rules.npy')
+
+    @contextmanager
+    def _locked(self):
+        """串行整個 rules.npy 的讀取-合併-取代：行程內以每個資料夾一把的鎖，跨行程以 rules.lock 檔案鎖"""
+        with self._locks_guard:
+            lock = self._locks.setdefault(os.path.abspath(self.root), threading.Lock())
+        os.makedirs(self.root, exist_ok=True)
+        with lock, open(os.path.join(self.root, 'rules.lock'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # 關檔時自動釋放
+            yield
+
+    def load(self) -> np.ndarray:
+        if not os.path.exists(self.path):
+            return np.empty(0, dtype=RULE_DTYPE)
+        return np.load(self.path, mmap_mode='r')
+
+    @staticmethod
+    def compile(symbol: str, intervals: List[TradingInterval], params: dict) -> np.ndarray:
+        """將一檔股票的 TradingInterval 轉為 RULE_DTYPE 列"""
+        rows = np.empty(len(intervals), dtype=RULE_DTYPE)
+        rows['symbol'] = symbol
+        rows['lower'] = [interval.lower_bound for interval in intervals]
+        rows['upper'] = [interval.upper_bound for interval in intervals]
+        rows['avg_profit'] = [interval.avg_profit for interval in intervals]
+        rows['probability'] = [interval.profit_probability for interval in intervals]
+        rows['sample_size'] = [interval.sample_size for interval in intervals]
+        rows['is_buy'] = [interval.is_buy_signal for interval in intervals]
+        rows['holding_period'] = params['holding_period']
+        rows['target_profit_ratio'] = params['target_profit_ratio']
+        rows['confidence_threshold'] = params['confidence_threshold']
+        return rows
+
+    def save(self, symbol: str, intervals: List[TradingInterval], params: dict):
+        self.save_many({symbol: (intervals, params)})
+
+    def save_many(self, rules: Dict[str, Tuple[List[TradingInterval], dict]]):
+        """替換 rules 中各股票的規則 (代號 → (交易區間, 分析參數))，其他股票的規則保留"""
+        if not rules:
+            return
+        compiled = [self.compile(symbol, intervals, params) for symbol, (intervals, params) in rules.items()]
+        with self._locked():
+            existing = self.load()
+            keep = existing[~np.isin(existing['symbol'], list(rules))]
+            table = np.concatenate([keep] + compiled)
+            table = table[np.lexsort((table['lower'], table['symbol']))]
+
+            fd, tmp_path = tempfile.mkstemp(prefix='rules.', suffix='.tmp', dir=self.root)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, table)
+                del existing, keep
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def intervals(self, symbol: str) -> List[TradingInterval]:
+        table = self.load()
+        rows = table[table['symbol'] == symbol]
+        return [TradingInterval(lower_bound=float(row['lower']),
+                                upper_bound=float(row['upper']),
+                                avg_profit=float(row['avg_profit']),
+                                profit_probability=float(row['probability']),
+                                sample_size=int(row['sample_size']),
+                                is_buy_signal=bool(row['is_buy']))
+                for row in rows]
+
+class SignalEvaluator:
+    """以 RuleTable 向量化判斷整批報價各自所在的交易區間 (lower <= 價格 < upper) 與買進訊號
+
+    每檔股票的區間下界映射到 [代號序號, 代號序號 + 0.5] 的合併鍵上，
+    整批報價只需一次 searchsorted 找代號、一次 searchsorted 找區間。
+    合併鍵的浮點誤差可能使價格在邊界附近落到相鄰的列，最後再以實際的上下界校正一列。
+    """
+
+    def __init__(self, rules: np.ndarray):
+        self.rules = rules
+        self.symbols, starts = np.unique(rules['symbol'], return_index=True)
+        self._starts = starts
+        self._ends = np.append(starts[1:], len(rules))
+        counts = self._ends - starts
+        segment = np.repeat(np.arange(len(self.symbols)), counts)
+
+        lower = np.asarray(rules['lower'])
+        self.low = lower[starts]
+        self.high = (np.maximum.reduceat(np.asarray(rules['upper']), starts)
+                     if len(rules) else np.empty(0))
+        self.span = np.where(self.high > self.low, self.high - self.low, 1.0)
+        self._keys = segment + 0.5 * (lower - self.low[segment]) / self.span[segment]
+
+    @classmethod
+    def load(cls, root: str = 'rule_tables') -> 'SignalEvaluator':
+        return cls(RuleTable(root).load())
+
+    def lookup(self, codes, prices) -> np.ndarray:
+        """回傳每筆報價對應的規則列位置，沒有規則或不在任何區間者為 -1"""
+        codes = np.asarray(codes).astype(str)
+        prices = np.asarray(prices, dtype=float)
+        if len(self.symbols) == 0:
+            return np.full(len(codes), -1, dtype=np.int64)
+
+        position = np.minimum(np.searchsorted(self.symbols, codes), len(self.symbols) - 1)
+        found = (self.symbols[position] == codes) & (prices >= self.low[position]) \
+            & (prices < self.high[position])
+
+        rows = np.full(len(codes), -1, dtype=np.int64)
+        position = position[found]
+        keys = position + 0.5 * (prices[found] - self.low[position]) / self.span[position]
+        candidate = np.searchsorted(self._keys, keys, side='right') - 1
+
+        # 以該股票實際的上下界校正合併鍵的捨入誤差：價格低於下界時退一列，達到上界且不低於下一列下界時進一列
+        start, end = self._starts[position], self._ends[position]
+        lower, upper = np.asarray(self.rules['lower']), np.asarray(self.rules['upper'])
+        price = prices[found]
+        candidate = np.clip(candidate, start, end - 1)
+        candidate -= (price < lower[candidate]) & (candidate > start)
+        following = np.minimum(candidate + 1, end - 1)
+        candidate = np.where((price >= upper[candidate]) & (following > candidate)
+                             & (price >= lower[following]), following, candidate)
+
+        # 區間之間可能有沒有樣本而被略過的空隙
+        inside = (price >= lower[candidate]) & (price < upper[candidate])
+        rows[np.flatnonzero(found)[inside]] = candidate[inside]
+        return rows
+
+    def evaluate(self, codes, prices) -> pd.DataFrame:
+        """以代號為索引的判斷結果；signal 為 '買進'、'觀望' 或 '無規則'"""
+        codes = np.asarray(codes).astype(str)
+        prices = np.asarray(prices, dtype=float)
+        rows = self.lookup(codes, prices)
+        matched = rows >= 0
+        picked = self.rules[np.where(matched, rows, 0)] if len(self.rules) else None
+
+        def field(name, fill=np.nan):
+            if picked is None:
+                return np.full(len(codes), fill)
+            return np.where(matched, picked[name], fill)
+
+        is_buy = field('is_buy', False).astype(bool)
+        return pd.DataFrame({
+            'price': prices,
+            'lower': field('lower'),
+            'upper': field('upper'),
+            'avg_profit': field('avg_profit'),
+            'probability': field('probability'),
+            'buy_signal': is_buy,
+            'signal': np.where(matched, np.where(is_buy, '買進', '觀望'), '無規則')
+        }, index=pd.Index(codes, name='Code'))
+
+    def evaluate_snapshot(self, snapshot) -> pd.DataFrame:
+        """判斷 TWSE STOCK_DAY_ALL 全市場快照 (檔案路徑或已載入的 list) 的收盤價"""
+        data = load_twse_snapshot(snapshot)
+        return self.evaluate(data.index.to_numpy(), data['Close'].to_numpy())
+
+    def evaluate_ticks(self, batches):
+        """逐批判斷即時報價；每批為 {代號: 價格} 或 (代號, 價格) 序列，依序產生判斷結果"""
+        for batch in batches:
+            if isinstance(batch, dict):
+                codes, prices = list(batch.keys()), list(batch.values())
+            else:
+                codes, prices = zip(*batch) if batch else ((), ())
+            yield self.evaluate(list(codes), list(prices))
+
+SCAN_COLUMNS = ['symbol', 'name', 'intervals', 'holding_period', 'target_profit_ratio',
+                'confidence_threshold', 'fitness', 'current_price', 'buy_signal', 'error']
+
+def _scan_symbol(symbol: str, name: str, use_genetic: bool, store_root: str, years: int) -> dict:
+    """掃描單一股票，於工作行程中執行"""
+    row = {'symbol': symbol, 'name': name, 'error': ''}
+    try:
+        # 資料已由主行程批次更新，工作行程只讀本地資料
+        store = BarStore(store_root, refresh_interval=float('inf'))
+        analyzer = StockAnalyzer(symbol=symbol, years_of_history=years, bar_store=store)
         if use_genetic:
-            print("開始遺傳算法優化...")
             analyzer.optimize_parameters()
-            print("優化完成!")
+            fitness = analyzer.ga.best_fitness
+        else:
+            analyzer.analyze_profit_patterns()
+            fitness = analyzer.fitness_function(analyzer.parameters())
+
+        interval = analyzer.current_interval()
+        row.update({
+            'intervals': analyzer.num_intervals,
+            'holding_period': analyzer.holding_period,
+            'target_profit_ratio': analyzer.target_profit_ratio,
+            'confidence_threshold': analyzer.confidence_threshold,
+            'fitness': float(fitness),
+            'current_price': float(analyzer.prices.close[-1]),
+            'buy_signal': bool(interval is not None and interval.is_buy_signal),
+            'rules': [[float(i.lower_bound), float(i.upper_bound), float(i.avg_profit),
+                       float(i.profit_probability), int(i.sample_size), bool(i.is_buy_signal)]
+                      for i in analyzer.trading_intervals]
+        })
+    except Exception as e:
+        row['error'] = str(e)
+    return row
+
+def scan_universe(stocks: Optional[List[Tuple[str, str]]] = None,
+                  use_genetic: bool = False,
+                  output_file: str = 'scan_results.csv',
+                  bar_store: Optional[BarStore] = None,
+                  years_of_history: int = 5,
+                  batch_size: int = 50,
+                  fetch_workers: int = 8,
+                  n_workers: Optional[int] = None,
+                  progress=None,
+                  rule_table: Optional[RuleTable] = None) -> pd.DataFrame:
+    """掃描整個股票清單並輸出依適應度排序的結果表
+
+    每完成一檔即寫入 output_file + '.partial' 檢查點，中斷後重新執行會略過已完成的股票；
+    全部完成後寫出排序結果並刪除檢查點。progress(done, total, symbol) 用於回報進度。
+    指定 rule_table 時一併寫入每檔股票的交易區間，供 SignalEvaluator 使用。
+    """
+    if stocks is None:
+        stocks = get_stock_list()
+    if bar_store is None:
+        bar_store = BarStore()
+    if progress is None:
+        progress = lambda done, total, symbol: logging.info(f"掃描進度 {done}/{total}: {symbol}")
+
+    checkpoint_file = output_file + '.partial'
+    rows = {}
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    rows[row['symbol']] = row
+                except ValueError:
+                    continue  # 中斷時可能留下寫到一半的最後一行
+        logging.info(f"從檢查點恢復 {len(rows)} 檔已完成的結果")
+
+        # 重寫檢查點，去除寫到一半的行
+        with open(checkpoint_file, 'w', encoding='utf-8') as f:
+            for row in rows.values():
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    pending = [(code, name) for code, name in stocks if code not in rows]
+    total = len(stocks)
+
+    with open(checkpoint_file, 'a', encoding='utf-8') as checkpoint, \
+            ProcessPoolExecutor(max_workers=n_workers) as executor:
+
+        def record(row: dict):
+            rows[row['symbol']] = row
+            checkpoint.write(json.dumps(row, ensure_ascii=False) + '\n')
+            checkpoint.flush()
+            progress(len(rows), total, row['symbol'])
+
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            errors = bar_store.refresh_many([code for code, _ in batch], years_of_history,
+                                            max_workers=fetch_workers)
+
+            futures = []
+            for code, name in batch:
+                if errors.get(code) is not None and bar_store.last_date(code) is None:
+                    record({'symbol': code, 'name': name, 'error': str(errors[code])})
+                    continue
+                futures.append(executor.submit(_scan_symbol, code, name, use_genetic,
+                                               bar_store.root, years_of_history))
+
+            for future in as_completed(futures):
+                record(future.result())
+
+    if rule_table is not None:
+        rule_table.save_many({
+            row['symbol']: ([TradingInterval(*rule) for rule in row['rules']],
+                            {name: row[name] for name in ('holding_period', 'target_profit_ratio',
+                                                          'confidence_threshold')})
+            for row in rows.values() if row.get('rules')
+        })
+
+    results = pd.DataFrame(list(rows.values()), columns=SCAN_COLUMNS)
+    results = results.sort_values('fitness', ascending=False, na_position='last').reset_index(drop=True)
+    results.to_csv(output_file, index=False, encoding='utf-8-sig')
+    os.remove(checkpoint_file)
+    return results
+
+class ResultCache:
+    """analyze_stock 的兩層結果快取：依位元組大小淘汰的記憶體 LRU，以及磁碟上的 pickle 檔
+
+    磁碟層超過 max_disk_bytes 時依修改時間刪除最舊的檔案 (讀到時會更新修改時間)
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, cache_dir: Optional[str] = 'result_cache',
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(symbol: str, use_genetic: bool, params: dict, last_date) -> str:
+        """以股票代碼、是否使用遺傳算法、分析參數與最後一根 K 棒日期組成快取鍵"""
+        raw = json.dumps([symbol, bool(use_genetic), sorted(params.items()), str(last_date)])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _size(value: dict) -> int:
+        return len(value['chart_png']) + len(value['rules_text'].encode('utf-8')) + 256
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _disk_files(self) -> List[Tuple[float, int, str]]:
+        """磁碟層的 (修改時間, 大小, 路徑)，依修改時間由舊到新排序"""
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.pkl') and entry.is_file():
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue  # 其他行程剛好刪除
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return sorted(files)
+
+    def _prune_disk(self):
+        """刪除最舊的檔案直到磁碟層不超過 max_disk_bytes"""
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files[:-1]:  # 至少保留剛寫入的一筆
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _remember(self, key: str, value: dict):
+        # 呼叫端須持有鎖
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        size = self._size(value)
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key][0]
+
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), 'rb') as f:
+                    value = pickle.load(f)
+                os.utime(self._path(key))  # 最近讀到的檔案最後才淘汰
+                with self._lock:
+                    self._remember(key, value)
+                    self.disk_hits += 1
+                return value
+            except Exception as e:
+                logging.warning(f"讀取結果快取失敗: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._remember(key, value)
+
+        if self.cache_dir is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        pickle.dump(value, f)
+                    os.replace(tmp_path, self._path(key))
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+                self._prune_disk()
+            except Exception as e:
+                logging.warning(f"寫入結果快取失敗: {e}")
+
+    def stats(self) -> dict:
+        disk_files = self._disk_files() if self.cache_dir is not None else []
+        with self._lock:
+            requests_total = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / requests_total if requests_total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'disk_entries': len(disk_files),
+                'disk_bytes': sum(size for _, size, _ in disk_files)
+            }
+
+# analyze_stock 共用的結果快取
+result_cache = ResultCache()
+
+def png_to_image(png: bytes):
+    from PIL import Image
+    return Image.open(BytesIO(png))
+
+def analyze_stock(stock_option: str, use_genetic: bool = False,
+                  progress_callback=None, cancel_event: Optional[threading.Event] = None,
+                  outcome: Optional[dict] = None):
+    """分析股票並返回結果 (交易規則文字與圖表影像)，相同資料與參數的請求直接使用快取
+
+    progress_callback / cancel_event 於遺傳算法優化時傳給 GeneticAlgorithm.evolve；
+    傳入 outcome 時寫入這次請求實際的結果 (與 metrics 日誌相同的 status：ok / cancelled / error)
+    """
+    with metrics.request('analyze_stock', stock=stock_option, use_genetic=use_genetic) as request_outcome:
+        try:
+            stock_code = stock_option.split(' - ')[0]
+        
+            # 創建分析器實例
+            analyzer = StockAnalyzer(symbol=stock_code)
+            with metrics.stage('fetch_data'):
+                analyzer.fetch_data()
+            if cancel_event is not None and cancel_event.is_set():
+                raise EvolutionCancelled("下載資料後取消")
+
+            cache_key = ResultCache.make_key(stock_code, use_genetic, analyzer.parameters(),
+                                             analyzer.prices.index[-1])
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                metrics.increment('result_cache_hits')
+                logging.info(f"{stock_code} 使用快取結果，快取統計: {result_cache.stats()}")
+                return cached['rules_text'], png_to_image(cached['chart_png'])
+            metrics.increment('result_cache_misses')
+        
+            if use_genetic:
+                print("開始遺傳算法優化...")
+                with metrics.stage('optimize_parameters'):
+                    analyzer.optimize_parameters(progress_callback=progress_callback,
+                                                 cancel_event=cancel_event)
+                print("優化完成!")
             
-        # 生成交易規則
-        rules = analyzer.generate_trading_rules()
-        rules_text = "\n".join(rules)
+            # 生成交易規則
+            with metrics.stage('generate_trading_rules'):
+                rules = analyzer.generate_trading_rules()
+            rules_text = "\n".join(rules)
 
-        # 生成圖表
-        fig = analyzer.plot_analysis()
+            # 生成圖表
+            with metrics.stage('render_chart'):
+                chart_png = analyzer.render_chart('png')
 
-        # 如果使用了遺傳算法，添加參數資訊
-        if use_genetic:
-            rules_text += "\n\n最佳參數設置："
-            rules_text += f"\n區間數：{analyzer.num_intervals}"
-            rules_text += f"\n持有期間：{analyzer.holding_period}天"
-            rules_text += f"\n目標獲利比例：{analyzer.target_profit_ratio:.2f}"
-            rules_text += f"\n信心水準：{analyzer.confidence_threshold:.2f}"
-            rules_text += f"\n最佳適應度：{analyzer.ga.best_fitness:.4f}"
+            # 如果使用了遺傳算法，添加參數資訊
+            if use_genetic:
+                rules_text += "\n\n最佳參數設置："
+                rules_text += f"\n區間數：{analyzer.num_intervals}"
+                rules_text += f"\n持有期間：{analyzer.holding_period}天"
+                rules_text += f"\n目標獲利比例：{analyzer.target_profit_ratio:.2f}"
+                rules_text += f"\n信心水準：{analyzer.confidence_threshold:.2f}"
+                rules_text += f"\n最佳適應度：{analyzer.ga.best_fitness:.4f}"
+                summary = analyzer.ga.run_summary
+                rules_text += (f"\n演化世代：{summary['generations']} 代 ({summary['stop_reason']})，"
+                               f"適應度計算 {summary['evaluations']} 次")
 
-        return rules_text, fig
+            result_cache.put(cache_key, {
+                'rules_text': rules_text,
+                'params': analyzer.parameters(),
+                'chart_png': chart_png
+            })
+            return rules_text, png_to_image(chart_png)
 
-    except Exception as e:
-        print(f"分析錯誤：{str(e)}")
-        return f"分析時發生錯誤：{str(e)}", None
+        except EvolutionCancelled as e:
+            logging.info(f"{stock_option} 分析已取消：{e}")
+            request_outcome['status'] = 'cancelled'
+            return "分析已取消", None
+        except Exception as e:
+            print(f"分析錯誤：{str(e)}")
+            request_outcome.update(status='error', error=str(e))
+            return f"分析時發生錯誤：{str(e)}", None
+        finally:
+            if outcome is not None:
+                outcome.update(request_outcome)
+
+class AnalysisJob:
+    """排入 AnalysisJobQueue 的單一分析工作；進度以 ('progress', dict) / ('done', 結果) 放入 updates"""
+
+    def __init__(self, job_id: str, stock_option: str, use_genetic: bool):
+        self.job_id = job_id
+        self.stock_option = stock_option
+        self.use_genetic = use_genetic
+        self.cancel_event = threading.Event()
+        self.updates = queue.Queue()
+        self.future = None
+        self.status = 'queued'  # queued → running → done / cancelled
+
+    def report(self, generation: int, best_fitness: float, best_params: Optional[dict]):
+        """GeneticAlgorithm.evolve 的 progress_callback"""
+        self.updates.put(('progress', {
+            'generation': generation,
+            'best_fitness': best_fitness,
+            'best_params': best_params
+        }))
+
+    def run(self):
+        if self.cancel_event.is_set():
+            self.status = 'cancelled'
+            result = ("分析已取消", None)
+        else:
+            self.status = 'running'
+            self.updates.put(('running', None))
+            outcome = {}
+            result = analyze_stock(self.stock_option, self.use_genetic,
+                                   progress_callback=self.report,
+                                   cancel_event=self.cancel_event,
+                                   outcome=outcome)
+            # 以分析實際的結果為準：優化完成後才取消 (例如繪圖時) 的工作仍會回傳完整結果
+            self.status = 'cancelled' if outcome.get('status') == 'cancelled' else 'done'
+        self.updates.put(('done', result))
+        return result
+
+class AnalysisJobQueue:
+    """以有限的工作執行緒執行分析，同時最多 max_concurrent 個，超出者排隊等候
+
+    取消時設定工作的 cancel_event：排隊中的工作直接移出佇列，執行中的工作在下一代開始前結束並釋放執行緒
+    """
+
+    def __init__(self, max_concurrent: int = 2):
+        self.max_concurrent = max_concurrent
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent,
+                                            thread_name_prefix='analysis-job')
+        self._jobs: Dict[str, AnalysisJob] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def submit(self, stock_option: str, use_genetic: bool = False) -> AnalysisJob:
+        with self._lock:
+            self._next_id += 1
+            job = AnalysisJob(f"job-{self._next_id}", stock_option, use_genetic)
+            self._jobs[job.job_id] = job
+        job.future = self._executor.submit(job.run)
+        job.future.add_done_callback(lambda _: self._forget(job.job_id))
+        return job
+
+    def _forget(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消工作；工作已結束或不存在時回傳 False"""
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = 'cancelled'
+            job.updates.put(('done', ("分析已取消", None)))
+            self._forget(job_id)
+        return True
+
+    def position(self, job_id: str) -> int:
+        """排隊中工作前面還有幾個排隊中的工作 (執行中或不存在時為 0)"""
+        with self._lock:
+            queued = [j for j in self._jobs.values() if j.status == 'queued']
+        ids = [j.job_id for j in queued]
+        return ids.index(job_id) if job_id in ids else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [j.status for j in self._jobs.values()]
+        return {
+            'max_concurrent': self.max_concurrent,
+            'running': statuses.count('running'),
+            'queued': statuses.count('queued')
+        }
+
+analysis_jobs = AnalysisJobQueue(max_concurrent=2)
+
+def format_job_progress(job: AnalysisJob, progress: dict, generations: int) -> str:
+    """將 evolve 的進度轉為顯示文字"""
+    lines = [f"{job.stock_option} 遺傳算法優化中：第 {progress['generation'] + 1}/{generations} 代",
+             f"目前最佳適應度：{progress['best_fitness']:.4f}"]
+    params = progress['best_params']
+    if params is not None:
+        lines.append(f"目前最佳參數：區間數 {params['intervals']}，持有期間 {params['holding_period']} 天，"
+                     f"目標獲利比例 {params['target_profit_ratio']:.2f}，"
+                     f"信心水準 {params['confidence_threshold']:.2f}")
+    return "\n".join(lines)
+
+def analyze_stock_stream(stock_option: str, use_genetic: bool = False,
+                         poll_interval: float = 0.5):
+    """Gradio 串流版本：排入 analysis_jobs 後逐代產生 (文字, 圖表, 工作代號)
+
+    Gradio 取消此產生器 (或使用者關閉頁面) 時一併取消背景工作，釋放工作執行緒
+    """
+    job = analysis_jobs.submit(stock_option, use_genetic)
+    generations = StockAnalyzer.GA_GENERATIONS
+    try:
+        while True:
+            try:
+                kind, payload = job.updates.get(timeout=poll_interval)
+            except queue.Empty:
+                if job.status == 'queued':
+                    yield (f"排隊中，前面還有 {analysis_jobs.position(job.job_id)} 個工作...",
+                           None, job.job_id)
+                continue
+            if kind == 'running':
+                yield f"{job.stock_option} 分析中...", None, job.job_id
+            elif kind == 'progress':
+                yield format_job_progress(job, payload, generations), None, job.job_id
+            elif kind == 'done':
+                rules_text, image = payload
+                yield rules_text, image, None
+                return
+    finally:
+        if job.status in ('queued', 'running'):
+            analysis_jobs.cancel(job.job_id)
+
+def cancel_analysis(job_id: Optional[str]) -> str:
+    """取消目前頁面的分析工作"""
+    if job_id and analysis_jobs.cancel(job_id):
+        return "分析已取消"
+    return "沒有進行中的分析"
 
 def main():
+    import gradio as gr
+
     # 設置日誌
     logging.basicConfig(level=logging.INFO)
     
@@ -500,28 +2785,282 @@ def main():
     }
     """
 
-    # 獲取股票列表
-    stocks = get_stock_list()
-    stock_options = [f"{code} - {name}" for code, name in stocks]
-
-    # 創建 Gradio 界面
-    iface = gr.Interface(
-        fn=analyze_stock,
-        inputs=[
-            gr.Dropdown(choices=stock_options, label="選擇股票", info="選擇要分析的股票"),
-            gr.Checkbox(label="使用遺傳算法優化參數", info="使用遺傳算法自動尋找最佳參數組合")
-        ],
-        outputs=[
-            gr.Textbox(label="交易規則", lines=10),
-            gr.Plot(label="分析圖表")
-        ],
-        title="台股交易策略分析系統 (遺傳算法優化版)",
-        description="選擇股票並決定是否使用遺傳算法優化參數，系統會分析歷史數據並生成交易建議。",
-        theme="default",
-        css=css
+    # 獲取股票列表：直接使用快取啟動，過期時於背景更新
+    def stock_options() -> List[str]:
+        return [f"{code} - {name}" for code, name in get_stock_list(block=False)]
+
+    # 創建 Gradio 界面：分析以串流方式回報遺傳算法進度，可隨時取消
+    with gr.Blocks(title="台股交易策略分析系統 (遺傳算法優化版)") as demo:
+        gr.Markdown("# 台股交易策略分析系統 (遺傳算法優化版)\n"
+                    "選擇股票並決定是否使用遺傳算法優化參數，系統會分析歷史數據並生成交易建議。")
+        with gr.Row():
+            with gr.Column():
+                stock_dropdown = gr.Dropdown(choices=stock_options(), label="選擇股票",
+                                             info="選擇要分析的股票")
+                use_genetic = gr.Checkbox(label="使用遺傳算法優化參數",
+                                          info="使用遺傳算法自動尋找最佳參數組合")
+                with gr.Row():
+                    submit_button = gr.Button("分析", variant="primary")
+                    cancel_button = gr.Button("取消")
+            with gr.Column():
+                rules_output = gr.Textbox(label="交易規則", lines=10)
+                chart_output = gr.Image(label="分析圖表", type="pil")
+        job_state = gr.State(None)
+
+        analysis_event = submit_button.click(analyze_stock_stream,
+                                             inputs=[stock_dropdown, use_genetic],
+                                             outputs=[rules_output, chart_output, job_state])
+        cancel_button.click(cancel_analysis, inputs=job_state, outputs=rules_output,
+                            cancels=[analysis_event])
+
+        # 每次載入頁面時帶入背景更新後的最新清單
+        demo.load(lambda: gr.Dropdown(choices=stock_options()), None, stock_dropdown)
+
+    # 啟用指標時提供 Prometheus 端點 (埠號由 STOCK_METRICS_PORT 設定)
+    if metrics.enabled:
+        metrics.serve(int(os.environ.get('STOCK_METRICS_PORT', 9108)))
+
+    # 分析由 analysis_jobs 控制並行數，Gradio 佇列只需讓串流事件同時進行
+    demo.queue(default_concurrency_limit=None)
+    demo.launch(theme="default", css=css)
+
+IMPORT_TIME_BUDGET = 1.5  # 秒；命令列只做分析時匯入本模組的時間上限
+HEAVY_MODULES = ('gradio', 'matplotlib', 'yfinance', 'requests')
+
+def measure_import_time(repeats: int = 3) -> dict:
+    """於全新的直譯器中量測匯入本模組的時間 (取最短)，並列出匯入後已載入的 HEAVY_MODULES"""
+    code = (
+        "import importlib.util, json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "spec = importlib.util.spec_from_file_location('stock_analysis', sys.argv[1])\n"
+        "module = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(module)\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': seconds,\n"
+        "                  'heavy_modules': [name for name in sys.argv[2:] if name in sys.modules]}))\n"
     )
+    runs = []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, '-c', code, os.path.abspath(__file__), *HEAVY_MODULES],
+                                   capture_output=True, text=True, check=True)
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {
+        'seconds': min(run['seconds'] for run in runs),
+        'budget': IMPORT_TIME_BUDGET,
+        'heavy_modules': runs[-1]['heavy_modules']
+    }
+
+def _finite(value):
+    """將 NaN / ±inf 轉為 None，讓輸出為合法 JSON"""
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def analysis_result(analyzer: StockAnalyzer) -> dict:
+    """分析結果 (參數、交易區間、規則與最新收盤價的訊號) 的 JSON 可序列化字典"""
+    if analyzer.trading_intervals is None:
+        analyzer.analyze_profit_patterns()
+    interval = analyzer.current_interval()
+    result = {
+        'symbol': analyzer.symbol,
+        'as_of': str(analyzer.prices.index[-1].date()),
+        'current_price': float(analyzer.prices.close[-1]),
+        'parameters': analyzer.parameters(),
+        'fitness': float(analyzer.fitness_function(analyzer.parameters())),
+        'buy_signal': bool(interval is not None and interval.is_buy_signal),
+        'intervals': [asdict(interval) for interval in analyzer.trading_intervals],
+        'rules': [rule.strip() for rule in analyzer.generate_trading_rules() if rule.strip()]
+    }
+    if analyzer.ga.run_summary:
+        result['optimization'] = analyzer.ga.run_summary
+    return _finite(result)
+
+def _result_rows(result: dict) -> List[dict]:
+    """CSV 輸出：每個交易區間一列，附上股票與參數欄位"""
+    base = {'symbol': result['symbol'], 'as_of': result.get('as_of'), 'error': result.get('error', '')}
+    base.update(result.get('parameters', {}))
+    base['fitness'] = result.get('fitness')
+    intervals = result.get('intervals') or [{}]
+    return [{**base, **interval} for interval in intervals]
+
+def _emit(records, fmt: str, output: Optional[str] = None):
+    """將結果以 JSON 或 CSV 寫到 output (未指定時寫到標準輸出)"""
+    if fmt == 'json':
+        text = json.dumps(_finite(records), ensure_ascii=False, indent=2) + '\n'
+    else:
+        text = pd.DataFrame(records).convert_dtypes().to_csv(index=False)
+    if output:
+        with open(output, 'w', encoding='utf-8-sig' if fmt == 'csv' else 'utf-8', newline='') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+def _analyze_symbol(args, symbol: str, optimize: bool, rule_table: Optional[RuleTable]) -> dict:
+    """命令列 analyze / optimize 的單一股票處理，失敗時回傳含 error 的結果"""
+    try:
+        analyzer = StockAnalyzer(symbol=symbol, years_of_history=args.years)
+        if args.intervals is not None:
+            analyzer.num_intervals = args.intervals
+        if args.holding_period is not None:
+            analyzer.holding_period = args.holding_period
+        analyzer.fetch_data()
+        if optimize:
+            analyzer.optimize_parameters(exhaustive=args.exhaustive,
+                                         state_store=GAStateStore(args.state_dir) if args.state_dir else None)
+        result = analysis_result(analyzer)
+        if rule_table is not None:
+            analyzer.save_rules(rule_table)
+        if args.chart:
+            os.makedirs(args.chart, exist_ok=True)
+            with open(os.path.join(args.chart, f"{symbol}.png"), 'wb') as f:
+                f.write(analyzer.render_chart('png'))
+    except Exception as e:
+        logging.error(f"{symbol} 分析失敗: {e}")
+        return {'symbol': symbol, 'error': str(e)}
+    return result
+
+def _cli_cross_section(args, rule_table: Optional[RuleTable]) -> List[dict]:
+    """optimize --cross-section：所有股票一起優化"""
+    analyzers = optimize_watchlist(args.symbols, years_of_history=args.years)
+    results = []
+    for symbol in args.symbols:
+        if symbol not in analyzers:
+            results.append({'symbol': symbol, 'error': f"無法取得股票 {symbol} 的資料"})
+            continue
+        results.append(analysis_result(analyzers[symbol]))
+        if rule_table is not None:
+            analyzers[symbol].save_rules(rule_table)
+    return results
+
+def _cli_analyze(args, optimize: bool) -> int:
+    rule_table = RuleTable(args.rules_dir) if args.rules_dir else None
+    if optimize and args.cross_section:
+        results = _cli_cross_section(args, rule_table)
+    else:
+        results = []
+        for symbol in args.symbols:
+            # 演化過程的 print 改寫到標準錯誤，避免混入 JSON/CSV 輸出
+            with redirect_stdout(sys.stderr):
+                results.append(_analyze_symbol(args, symbol, optimize, rule_table))
 
-    iface.launch()
+    if args.format == 'json':
+        _emit(results, 'json', args.output)
+    else:
+        _emit([row for result in results for row in _result_rows(result)], 'csv', args.output)
+    return 1 if any('error' in result for result in results) else 0
+
+def _cli_scan(args) -> int:
+    # 指定代號時只需要名稱，不等待股票清單更新
+    stocks = get_stock_list(block=not args.symbols)
+    if args.symbols:
+        names = dict(stocks)
+        stocks = [(code, names.get(code, '')) for code in args.symbols]
+    with redirect_stdout(sys.stderr):
+        results = scan_universe(stocks, use_genetic=args.genetic, output_file=args.output,
+                                years_of_history=args.years, n_workers=args.workers,
+                                rule_table=RuleTable(args.rules_dir) if args.rules_dir else None)
+    logging.info(f"已掃描 {len(results)} 檔股票，結果寫入 {args.output}")
+    return 0
+
+def _cli_signals(args) -> int:
+    signals = SignalEvaluator.load(args.rules_dir).evaluate_snapshot(args.snapshot)
+    _emit(signals.reset_index().to_dict('records'), args.format, args.output)
+    return 0
+
+def _cli_import_time(args) -> int:
+    result = measure_import_time()
+    result['budget'] = args.budget
+    _emit(result, 'json')
+    return 0 if result['seconds'] <= args.budget and not result['heavy_modules'] else 1
+
+def _cli_benchmark(args) -> int:
+    # 效能測試與模擬資料放在獨立的 benchmarks.py，一般分析不會載入
+    import benchmarks
+
+    kwargs = {'baseline_file': args.baseline, 'update_baseline': args.update_baseline,
+              'time_tolerance': args.time_tolerance}
+    if args.repeats is not None:
+        kwargs['repeats'] = args.repeats
+    with redirect_stdout(sys.stderr):
+        result = benchmarks.run_benchmarks(**kwargs)
+    _emit({'baseline': args.baseline, 'stages': len(result['stages']),
+           'regressions': result['regressions']}, 'json')
+    return 1 if result['regressions'] else 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="台股交易策略分析系統；不指定子命令時啟動網頁介面")
+    parser.add_argument('-v', '--verbose', action='store_true', help="輸出 INFO 等級的日誌")
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('ui', help="啟動 Gradio 網頁介面")
+
+    for name, help_text in (('analyze', "以目前參數分析股票"), ('optimize', "以遺傳算法優化參數後分析股票")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('symbols', nargs='+', help="股票代號，例如 2330")
+        command.add_argument('--years', type=int, default=5, help="歷史資料年數")
+        command.add_argument('--intervals', type=int, help="價格區間數")
+        command.add_argument('--holding-period', type=int, help="持有天數")
+        command.add_argument('--format', choices=('json', 'csv'), default='json')
+        command.add_argument('--output', help="輸出檔案 (預設為標準輸出)")
+        command.add_argument('--chart', metavar='DIR', help="另將圖表存成 DIR/<代號>.png")
+        command.add_argument('--rules-dir', metavar='DIR', help="將交易區間寫入 DIR 的規則表")
+        if name == 'optimize':
+            command.add_argument('--exhaustive', action='store_true', help="窮舉整個參數空間")
+            command.add_argument('--cross-section', action='store_true',
+                                 help="所有股票一起以 optimize_cross_section 優化")
+            command.add_argument('--state-dir', metavar='DIR',
+                                 help="以 DIR 中保存的遺傳算法狀態暖啟動，並保存這次的狀態")
+
+    command = commands.add_parser('scan', help="掃描股票清單並輸出依適應度排序的 CSV")
+    command.add_argument('--symbols', nargs='+', help="只掃描這些代號 (預設為全部上市股票)")
+    command.add_argument('--genetic', action='store_true', help="每檔股票以遺傳算法優化")
+    command.add_argument('--years', type=int, default=5, help="歷史資料年數")
+    command.add_argument('--workers', type=int, help="工作行程數")
+    command.add_argument('--output', default='scan_results.csv', help="輸出 CSV 檔案")
+    command.add_argument('--rules-dir', metavar='DIR', help="將交易區間寫入 DIR 的規則表")
+
+    command = commands.add_parser('signals', help="以規則表判斷 STOCK_DAY_ALL 快照的訊號")
+    command.add_argument('snapshot', help="STOCK_DAY_ALL.json 路徑")
+    command.add_argument('--rules-dir', default='rule_tables', metavar='DIR')
+    command.add_argument('--format', choices=('json', 'csv'), default='csv')
+    command.add_argument('--output', help="輸出檔案 (預設為標準輸出)")
+
+    command = commands.add_parser('import-time', help="量測匯入時間是否在預算內")
+    command.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET, help="秒")
+
+    command = commands.add_parser('benchmark', help="執行離線效能測試，與基準相比有退步時以非零狀態結束")
+    command.add_argument('--baseline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'benchmark_baseline.json'),
+                         help="效能基準 JSON (預設為程式旁的 benchmark_baseline.json)")
+    command.add_argument('--update-baseline', action='store_true', help="以這次的結果覆寫基準")
+    command.add_argument('--repeats', type=int, help="每個階段執行次數 (取最短時間)")
+    command.add_argument('--time-tolerance', type=float, default=0.5,
+                         help="時間超過基準多少比例視為退步")
+    return parser
+
+def cli(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點；結果寫到標準輸出，進度與日誌寫到標準錯誤"""
+    args = build_parser().parse_args(argv)
+    if args.command in (None, 'ui'):
+        main()
+        return 0
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr)
+    handlers = {
+        'analyze': lambda: _cli_analyze(args, optimize=False),
+        'optimize': lambda: _cli_analyze(args, optimize=True),
+        'scan': lambda: _cli_scan(args),
+        'signals': lambda: _cli_signals(args),
+        'import-time': lambda: _cli_import_time(args),
+        'benchmark': lambda: _cli_benchmark(args)
+    }
+    return handlers[args.command]()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(cli())
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""BarStore 與 StockAnalyzer.fetch_data 的離線測試：以本地假資料來源取代 Yahoo Finance"""
+import importlib.util
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'import yfinance as yf.py')
+_spec = importlib.util.spec_from_file_location('stock_analysis', SCRIPT)
+stock = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(stock)
+
+
+def make_bars(end: pd.Timestamp, periods: int, seed: int = 0) -> pd.DataFrame:
+    """模擬 yfinance history() 的日K (含台北時區的索引與額外欄位)"""
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, periods))
+    index = pd.bdate_range(end=end, periods=periods).tz_localize('Asia/Taipei')
+    return pd.DataFrame({
+        'Open': close,
+        'High': close + 1,
+        'Low': close - 1,
+        'Close': close,
+        'Volume': rng.integers(1_000, 10_000, periods).astype(float),
+        'Dividends': 0.0
+    }, index=index)
+
+
+class StubSource:
+    """記錄每次呼叫的假資料來源；history 為完整歷史，只回傳 start 之後或全部的資料"""
+
+    def __init__(self, history: pd.DataFrame):
+        self.history = history
+        self.calls = []
+        self.error = None
+
+    def __call__(self, symbol, start=None, period=None):
+        self.calls.append({'symbol': symbol, 'start': start, 'period': period})
+        if self.error is not None:
+            raise self.error
+        if start is None:
+            return self.history
+        return self.history[self.history.index.tz_localize(None) >= start]
+
+
+@pytest.fixture
+def today():
+    return pd.Timestamp.today().normalize()
+
+
+def test_first_refresh_fetches_full_period(tmp_path, today):
+    history = make_bars(today - pd.Timedelta(days=3), 300)
+    source = StubSource(history)
+    store = stock.BarStore(str(tmp_path), source=source)
+
+    assert store.refresh('2330', years=5) == len(history)
+
+    assert source.calls == [{'symbol': '2330', 'start': None, 'period': '5y'}]
+    stored = store.read('2330')
+    assert len(stored) == len(history)
+    assert stored.index.tz is None
+    np.testing.assert_allclose(stored['Close'], history['Close'])
+    assert store.last_date('2330') == history.index[-1].tz_localize(None)
+
+
+def test_refresh_fetches_only_bars_from_last_stored_date(tmp_path, today):
+    history = make_bars(today - pd.Timedelta(days=3), 300)
+    source = StubSource(history.iloc[:-5])
+    store = stock.BarStore(str(tmp_path), source=source, refresh_interval=0)
+    store.refresh('2330', years=5)
+    last = store.last_date('2330')
+
+    source.history = history
+    assert store.refresh('2330', years=5) == 5
+
+    assert source.calls[-1] == {'symbol': '2330', 'start': last, 'period': None}
+    stored = store.read('2330')
+    assert len(stored) == len(history)
+    np.testing.assert_allclose(stored['Close'], history['Close'])
+
+
+def test_refresh_overwrites_partial_last_bar(tmp_path, today):
+    history = make_bars(today, 300)
+    partial = history.copy()
+    partial.iloc[-1, partial.columns.get_loc('Close')] = 100.0  # 盤中抓到的未完成收盤價
+    source = StubSource(partial)
+    store = stock.BarStore(str(tmp_path), source=source, refresh_interval=0)
+    store.refresh('2330', years=5)
+
+    history.iloc[-1, history.columns.get_loc('Close')] = 123.0
+    source.history = history
+    assert store.refresh('2330', years=5) == 0
+
+    stored = store.read('2330')
+    assert len(stored) == len(history)
+    assert stored['Close'].iloc[-1] == 123.0
+
+
+def test_refresh_redownloads_full_period_after_dividend(tmp_path, today):
+    history = make_bars(today - pd.Timedelta(days=3), 300)
+    source = StubSource(history.iloc[:-5])
+    store = stock.BarStore(str(tmp_path), source=source, refresh_interval=0)
+    store.refresh('2330', years=5)
+
+    # 除息後 history() 整段的還原價格都往下調整
+    adjusted = history.copy()
+    adjusted[['Open', 'High', 'Low', 'Close']] *= 0.97
+    adjusted.iloc[-2, adjusted.columns.get_loc('Dividends')] = 3.0
+    source.history = adjusted
+    assert store.refresh('2330', years=5) == 5
+
+    assert source.calls[-1] == {'symbol': '2330', 'start': None, 'period': '5y'}
+    stored = store.read('2330')
+    assert len(stored) == len(history)
+    np.testing.assert_allclose(stored['Close'], adjusted['Close'])
+
+    # 除息日已儲存後，下次只補抓新資料
+    store.refresh('2330', years=5)
+    assert source.calls[-1]['period'] is None
+
+
+def test_refresh_skips_source_within_refresh_interval(tmp_path, today):
+    source = StubSource(make_bars(today - pd.Timedelta(days=3), 300))
+    store = stock.BarStore(str(tmp_path), source=source, refresh_interval=3600)
+    store.refresh('2330', years=5)
+
+    assert store.refresh('2330', years=5) == 0
+    assert len(source.calls) == 1
+
+    # 超過更新間隔後才再次查詢資料來源
+    meta = store.read_meta('2330')
+    meta['refreshed_at'] = time.time() - 7200
+    store._write_meta('2330', meta)
+    store.refresh('2330', years=5)
+    assert len(source.calls) == 2
+
+
+def test_fetch_data_falls_back_to_stored_bars_when_source_fails(tmp_path, today):
+    history = make_bars(today - pd.Timedelta(days=3), 300)
+    source = StubSource(history)
+    store = stock.BarStore(str(tmp_path), source=source, refresh_interval=0)
+    store.refresh('2330', years=5)
+
+    source.error = ConnectionError("Yahoo 無法連線")
+    with pytest.raises(ConnectionError):
+        store.refresh('2330', years=5)
+
+    analyzer = stock.StockAnalyzer(symbol='2330', years_of_history=5, bar_store=store)
+    data = analyzer.fetch_data()
+
+    assert len(source.calls) == 3  # 已有本地資料時 fetch_data 只查詢一次，不重試
+    assert len(data) == len(history)
+    np.testing.assert_allclose(data['Close'], history['Close'])
+
+
+def test_read_date_range_and_columns(tmp_path, today):
+    history = make_bars(today - pd.Timedelta(days=3), 300)
+    store = stock.BarStore(str(tmp_path), source=StubSource(history))
+    store.refresh('2330', years=5)
+
+    dates = history.index.tz_localize(None)
+    start, end = dates[100], dates[149]
+    data = store.read('2330', start=start, end=end, columns=['Close', 'Volume'])
+
+    assert list(data.columns) == ['Close', 'Volume']
+    assert data.index[0] == start and data.index[-1] == end
+    assert len(data) == 50
+    np.testing.assert_allclose(data['Volume'], history['Volume'].iloc[100:150])
+